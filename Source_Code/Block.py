@@ -1,19 +1,30 @@
 from typing import Any
 import random
 from copy import deepcopy
-from functools import reduce
 from Transaction import Transaction, CoinBaseTransaction
 import logging
 
 from DiscreteEventSim import simulation, Event, EventType
 from config import CONFIG
-from utils import expon_distribution, generate_random_id
-from visualisation import visualize_peer
+from utils import expon_distribution, format_id
 
 logger = logging.getLogger(__name__)
 
+GENESIS_BLOCK_ID = 0
+simulation.ids.register("block", start=GENESIS_BLOCK_ID + 1)
+
 
 class Block:
+    __slots__ = (
+        "block_id",
+        "prev_block",
+        "transactions",
+        "timestamp",
+        "miner",
+        "is_private",
+        "prev_block_hash",
+        "index",
+    )
 
     def __init__(
         self,
@@ -24,56 +35,70 @@ class Block:
         is_private: bool = False,
         id: int = None,
     ):
-        if id:
+        if id is not None:
             self.block_id: int = id
         else:
-            self.block_id: int = generate_random_id(4)
+            self.block_id: int = simulation.ids.next_id("block")
         self.prev_block: "Block" = prev_block
         self.transactions: list[Transaction] = transactions
         self.timestamp: float = timestamp
         self.miner: Any = miner
         self.is_private: bool = is_private
+        # position in simulation.block_registry, -1 until some peer accepts it
+        self.index: int = -1
 
-        self.prev_block_hash = hash(prev_block) if prev_block else None
+        self.prev_block_hash = prev_block.header_hash if prev_block else None
 
-        logger.info(f"{self} <{EventType.BLOCK_CREATE}> {self.description()}")
+        if logger.isEnabledFor(logging.INFO):
+            logger.info("%s <%s> %s", self, EventType.BLOCK_CREATE, self.description())
 
     @property
     def header(self) -> str:
-        if self.block_id == 0:
+        if self.block_id == GENESIS_BLOCK_ID:
             return hash("genesis block")
         if self.transactions == []:
             transaction_ids = "no transactions"
         else:
-            transaction_ids = reduce(
-                lambda a, b: a + b, map(lambda x: x.txn_id, self.transactions)
-            )
+            transaction_ids = "-".join(str(x.txn_id) for x in self.transactions)
         return (
             f"{self.block_id}-{self.prev_block_hash}-{self.timestamp}-{transaction_ids}"
         )
 
+    @property
+    def export_id(self):
+        """
+        block id as it appears in exported data
+        """
+        if self.block_id == GENESIS_BLOCK_ID:
+            return "gen_blk"
+        return format_id("B", self.block_id)
+
     @property
     def num_txns(self) -> int:
         return len(self.transactions)
 
-    def __hash__(self) -> int:
+    @property
+    def header_hash(self) -> int:
         return hash(self.header)
 
+    def __hash__(self) -> int:
+        # ids are unique, hashing the header would rebuild it on every lookup
+        return hash(self.block_id)
+
     def __repr__(self) -> str:
         return f"Block(id={self.block_id})"
 
-    @property
-    def __dict__(self) -> dict:
+    def to_dict(self) -> dict:
         dict_obj = {
             "self": self.__repr__(),
-            "block_id": self.block_id,
+            "block_id": self.export_id,
             "prev_block": "",
-            "self_hash": self.__hash__(),
+            "self_hash": self.header_hash,
             "num_txns": self.num_txns,
-            "transactions": sorted(
-                list(map(lambda x: x.__dict__, self.transactions)),
-                key=lambda x: x["txn_id"],
-            ),
+            "transactions": [
+                txn.to_dict()
+                for txn in sorted(self.transactions, key=lambda x: x.txn_id)
+            ],
             "timestamp": self.timestamp,
             "prev_block_hash": self.prev_block_hash,
             "miner": self.miner.__repr__(),
@@ -83,8 +108,8 @@ class Block:
             dict_obj.update(
                 {
                     "prev_block": {
-                        "id": self.prev_block.block_id,
-                        "hash": self.prev_block.__hash__(),
+                        "id": self.prev_block.export_id,
+                        "hash": self.prev_block.header_hash,
                     }
                 }
             )
@@ -108,8 +133,8 @@ def gen_genesis_block():
     """
     Generate genesis block
     """
-    genesis_block = Block(None, [], 0, "none")
-    genesis_block.block_id = "gen_blk"
+    genesis_block = Block(None, [], 0, "none", id=GENESIS_BLOCK_ID)
+    simulation.block_registry.register(genesis_block)
     return genesis_block
 
 
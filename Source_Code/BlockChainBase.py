@@ -1,12 +1,16 @@
 from typing import Any
+from collections import deque
 import logging
 
 from Block import Block, GENESIS_BLOCK
 from Transaction import Transaction, CoinBaseTransaction
 from config import CONFIG
 from DiscreteEventSim import simulation, Event, EventType
-from utils import expon_distribution
-from visualisation import visualize_peer
+from utils import expon_distribution, spawn_rng
+from orphans import OrphanPool
+from chainindex import ChainIndex
+from registry import BlockView
+from metrics import ChainMetrics
 
 logger = logging.getLogger(__name__)
 
@@ -20,11 +24,9 @@ class BlockChainBase:
         peers: list[Any],
         owner_peer: Any,
     ):
-        self._blocks: list[Block] = []
         self._peer_id: Any = owner_peer
         self._peers: list[Any] = peers
         self._new_transactions: list[Transaction] = []
-        self._block_arrival_time: dict[Block, float] = {}
         self._broadcast_block: Any = broadcast_block_function
 
         self._current_mining_event: Event = None
@@ -32,23 +34,38 @@ class BlockChainBase:
         self._longest_chain_length: int = 0
         self._longest_chain_leaf: Block = None
 
-        self._missing_parent_blocks: list[Block] = []
+        self._orphans = OrphanPool(CONFIG.ORPHAN_POOL_SIZE, CONFIG.ORPHAN_TIMEOUT)
+        self._orphan_worklist: list[Block] = None  # see _attach_orphans
+
+        # finality: balances up to _final_block are kept as a snapshot and
+        # nothing below it is walked or kept, see _advance_finality
+        self._final_block: Block = GENESIS_BLOCK
+        self._final_balance: dict[Any, float] = {
+            peer: CONFIG.INITIAL_COINS for peer in peers
+        }
+        self._num_pruned_blocks = 0
+        # ids of the transactions in finalized blocks, their dedup entries
+        # are forgotten so a late copy must not be accepted again. Kept until
+        # every peer finalized the block (Transaction.finalized), the blocks
+        # are queued with their heights to expire them.
+        self._finalized_txn_ids: set[int] = set()
+        self._finalized_blocks: deque[tuple[int, Block]] = deque()
 
         self.avg_interval_time = CONFIG.AVG_BLOCK_MINING_TIME
         self.cpu_power: float = cpu_power
+        self.rng = spawn_rng()  # mining delays
 
         self._init_genesis_block(peers)
 
-    @property
-    def __dict__(self) -> dict:
-        blocks = list(map(lambda x: x.__dict__, self._blocks))
-        blocks = sorted(blocks, key=lambda x: x["block_id"])
-        block_arrival_times = list(
-            map(
-                lambda x: {x.__repr__(): self._block_arrival_time[x]},
-                self._block_arrival_time,
-            )
-        )
+    def to_dict(self) -> dict:
+        registry = simulation.block_registry
+        blocks = sorted(self._blocks, key=lambda x: x.block_id)
+        blocks = list(map(registry.block_dict, blocks))
+        block_arrival_times = [
+            {block.__repr__(): float(self._blocks.arrival_time(block))}
+            for block in self._blocks
+            if block is not GENESIS_BLOCK
+        ]
         block_arrival_times = sorted(
             block_arrival_times, key=lambda x: list(x.values())[0]
         )
@@ -73,9 +90,15 @@ class BlockChainBase:
 
     def _init_genesis_block(self, peers: list[Any]):
         genesis_block = GENESIS_BLOCK
-        self._blocks.append(genesis_block)
+        # blocks known to this peer with their arrival times
+        self._blocks = BlockView(simulation.block_registry)
+        self._blocks.add(genesis_block, 0.0)
+        self._index = ChainIndex(self._peer_id, self._blocks, genesis_block)
         self._longest_chain_length = 1
         self._longest_chain_leaf = genesis_block
+        self._metrics = ChainMetrics(genesis_block)
+        if CONFIG.FINALITY_DEPTH is not None:
+            simulation.block_registry.track_final(self._peer_id.id, genesis_block)
         for peer in peers:
             self._branch_balance(genesis_block).update({peer: CONFIG.INITIAL_COINS})
 
@@ -83,29 +106,43 @@ class BlockChainBase:
         length = 0
         cur_block = block
         while cur_block:
+            if cur_block.index >= 0:
+                # registered, the walk would stop at a block cut by finality
+                return length + self._index.height(cur_block)
             length += 1
             cur_block = cur_block.prev_block
         return length
 
+    def _blocks_since_final(self, block: Block) -> list[Block]:
+        """
+        blocks of the branch up to block above the final block, oldest first
+        """
+        blocks = []
+        while block is not self._final_block:
+            blocks.append(block)
+            block = block.prev_block
+        blocks.reverse()
+        return blocks
+
     def _branch_balance(self, block: Block):
-        if block == GENESIS_BLOCK:
-            return {peer: CONFIG.INITIAL_COINS for peer in self._peers}
-        prev_block = block.prev_block
-        balances_upto_block = self._branch_balance(prev_block)
-        for transaction in block.transactions:
-            if transaction.from_id:
-                balances_upto_block[transaction.from_id] -= transaction.amount
-            balances_upto_block[transaction.to_id] += transaction.amount
+        balances_upto_block = dict(self._final_balance)
+        for branch_block in self._blocks_since_final(block):
+            for transaction in branch_block.transactions:
+                if transaction.from_id:
+                    balances_upto_block[transaction.from_id] -= transaction.amount
+                balances_upto_block[transaction.to_id] += transaction.amount
         return balances_upto_block
 
     def _branch_transaction(self, block: Block):
-        if block == GENESIS_BLOCK:
-            return []
-        prev_block = block.prev_block
-        prev_branch_txns = self._branch_transaction(prev_block)
-        for transaction in block.transactions:
-            prev_branch_txns.append(transaction)
-        return prev_branch_txns
+        """
+        transactions of the branch up to block, transactions of finalized
+        blocks are no longer tracked
+        """
+        return [
+            transaction
+            for branch_block in self._blocks_since_final(block)
+            for transaction in branch_block.transactions
+        ]
 
     def _validate_block(self, block: Block) -> bool:
         """
@@ -113,27 +150,57 @@ class BlockChainBase:
         2. transactions are not repeated
         """
         prev_block = block.prev_block
-        if prev_block not in self._blocks:
+        registry = simulation.block_registry
+        final_height = self._index.height(self._final_block)
+        if registry.is_pruned(block) or (
+            block.index >= 0 and self._index.height(block) <= final_height
+        ):
+            logger.info(
+                "%s block_dropped %s at or below the final block !!",
+                self.peer_id,
+                block,
+            )
+            return False
+        if (
+            prev_block is None
+            or registry.is_pruned(prev_block)
+            or (
+                prev_block.index >= 0
+                and self._index.height(prev_block) <= final_height
+                and prev_block is not self._final_block
+            )
+        ):
+            # a new block on an abandoned branch, its parent is never coming
+            logger.info(
+                "%s block_dropped %s previous block below the final block !!",
+                self.peer_id,
+                block,
+            )
+            return False
+        if prev_block not in self._index:
             logger.info(
                 "%s block_dropped %s previous block missing !!", self.peer_id, block
             )
-            if block not in self._missing_parent_blocks:
-                self._missing_parent_blocks.append(block)
+            self._orphans.add(block, simulation.clock)
             return False
-        if block in self._blocks:
+        if block in self._index:
             logger.info(
                 "%s block_dropped %s block already in blockchain !!",
                 self.peer_id,
                 block,
             )
             return False
+        balances_upto_block = self._branch_balance(prev_block)
+        branch_transactions = set(self._branch_transaction(prev_block))
         for transaction in block.transactions:
-            if not self._validate_transaction(transaction, prev_block):
+            if not self._validate_transaction(
+                transaction, prev_block, balances_upto_block
+            ):
                 logger.info(
                     "%s block_dropped %s invalid transaction !!", self.peer_id, block
                 )
                 return False
-            if transaction in self._branch_transaction(prev_block):
+            if transaction in branch_transactions or self.is_finalized(transaction):
                 logger.info(
                     "%s block_dropped %s %s transaction already in blockchain!!",
                     self.peer_id,
@@ -146,12 +213,13 @@ class BlockChainBase:
         return True
 
     def _validate_transaction(
-        self, transaction: Transaction, prev_block: Block
+        self, transaction: Transaction, prev_block: Block, balances_upto_block=None
     ) -> bool:
         """
         1. no balance of any peer shouldn't go negative
         """
-        balances_upto_block = self._branch_balance(prev_block)
+        if balances_upto_block is None:
+            balances_upto_block = self._branch_balance(prev_block)
         if (
             transaction.from_id
             and balances_upto_block[transaction.from_id] < transaction.amount
@@ -173,13 +241,12 @@ class BlockChainBase:
         #     self.avg_interval_time * (num_blocks-1) + interval_time) / num_blocks
         # logger.debug("Avg interval updated %s", self.avg_interval_time)
 
-    def _update_block_arrival_time(self, block: Block):
-        self._block_arrival_time[block] = simulation.clock
-
-    def _add_block(self, block: Block) -> bool:
+    def _add_block(self, block: Block, finalize: bool = True) -> bool:
         """
         Add a block to the chain
         """
+        # the tip as left by the previous block, before block changes it
+        self._metrics.observe(self._index, self._get_longest_chain_leaf())
         for transaction in block.transactions:
             # if transaction in self._new_transactions:
             if isinstance(transaction, CoinBaseTransaction):
@@ -187,16 +254,103 @@ class BlockChainBase:
             if transaction in self._new_transactions:
                 self._new_transactions.remove(transaction)
 
-        self._blocks.append(block)
-        self._update_block_arrival_time(block)
+        self._blocks.add(block, simulation.clock)
+        self._index.add(block)
+        if simulation.trace_recorder:
+            simulation.trace_recorder.record_accepted(
+                self._peer_id, block, simulation.clock
+            )
+        if finalize and CONFIG.FINALITY_DEPTH is not None:
+            self._advance_finality()
         # self._update_avg_interval_time(block)
         # self.plot_frame()
         logger.info("%s %s added", self.peer_id, block)
 
+    def _advance_finality(self):
+        """
+        Finalize the block FINALITY_DEPTH below the longest tip, or the
+        common ancestor of all tips still within that depth if it is older.
+        Its balances become the snapshot balance walks start from; blocks
+        that do not descend from it are dropped from this peer, together
+        with their orphans and message dedup entries. Transactions of
+        finalized blocks are remembered by id only (is_finalized) until
+        every peer finalized them, then the registry prunes (track_final).
+        """
+        index = self._index
+        longest = index.longest
+        final_height = index.height(longest) - CONFIG.FINALITY_DEPTH
+        if final_height <= index.height(self._final_block):
+            return
+        final = index.ancestor_at(longest, final_height)
+        for tip in index.tips:
+            if index.height(tip) > final_height:
+                final = index.common_ancestor(final, tip)
+        final = self._finality_limit(final)
+        if index.height(final) <= index.height(self._final_block):
+            return
+
+        finalized = self._blocks_since_final(final)
+        dropped = index.prunable(final)
+        sink = simulation.prune_sink
+        if sink:
+            for block in dropped:
+                sink.emit(
+                    {
+                        "peer": self._peer_id.id,
+                        "arrival_time": float(self._blocks.arrival_time(block)),
+                        "block": block.to_dict(),
+                    }
+                )
+        # the metrics tip must not be left on a block the registry may drop
+        self._metrics.observe(index, self._get_longest_chain_leaf())
+        self._final_balance = self._branch_balance(final)
+        self._final_block = final
+        index.prune(dropped)
+        self._num_pruned_blocks += len(dropped)
+
+        registry = simulation.block_registry
+        final_height = index.height(final)
+        self._orphans.evict_if(
+            lambda orphan: registry.is_pruned(orphan.prev_block)
+            or orphan.prev_block.index >= 0
+            and index.height(orphan.prev_block) <= final_height
+            and orphan.prev_block is not final
+        )
+        forget = list(dropped)
+        for block in finalized:
+            forget.extend(block.transactions)
+            for transaction in block.transactions:
+                self._finalized_txn_ids.add(transaction.txn_id)
+            self._finalized_blocks.append((index.height(block), block))
+        self._peer_id.forget_messages(forget)
+        registry.track_final(self._peer_id.id, final)
+        queued = self._finalized_blocks
+        if queued and queued[0][0] <= registry.final_height:
+            while queued and queued[0][0] <= registry.final_height:
+                queued.popleft()
+            # rebuilt instead of discarded from, a set keeps its peak size
+            self._finalized_txn_ids = {
+                transaction.txn_id
+                for _, block in queued
+                for transaction in block.transactions
+            }
+        logger.debug(
+            "%s finalized %s, %s blocks pruned", self._peer_id, final, len(dropped)
+        )
+
+    def _finality_limit(self, final: Block) -> Block:
+        """
+        latest block that may be finalized instead of final
+        """
+        return final
+
     def add_block(self, block: Block):
         raise NotImplementedError
 
     def _get_longest_chain(self) -> list[Block]:
+        return self._get_chain(self._get_longest_chain_leaf())
+
+    def _get_longest_chain_leaf(self) -> Block:
         raise NotImplementedError
 
     def _mine_block_end(self, block: Block):
@@ -206,12 +360,15 @@ class BlockChainBase:
         raise NotImplementedError
 
     def plot_frame(self):
-        peer_json = self.peer_id.__dict__
+        if not CONFIG.VISUALIZE:
+            return
+        import os
+        from visualisation import visualize_peer
+
+        peer_json = self.peer_id.to_dict()
         if not hasattr(self, "frame"):
             self.frame = 0
         self.frame += 1
-        import os
-
         os.makedirs(f"frames/peer_{self.peer_id.id}", exist_ok=True)
         visualize_peer(
             peer_json, f"frames/peer_{self.peer_id.id}/{str(self.frame).zfill(3)}.svg"
@@ -219,28 +376,48 @@ class BlockChainBase:
         logger.debug("%s plotting frame %s", self.peer_id, self.frame)
 
     def missing_parent_count(self):
-        return len(self._missing_parent_blocks)
+        return len(self._orphans)
+
+    def mempool_size(self) -> int:
+        return len(self._new_transactions)
+
+    def num_tips(self) -> int:
+        return len(self._index.tips)
 
-    def _validate_saved_blocks(self):
-        remove_blocks = []
-        for block in self._missing_parent_blocks:
-            if self._validate_block(block):
-                remove_blocks.append(block)
-                self._add_block(block)
-        for block in remove_blocks:
-            self._missing_parent_blocks.remove(block)
+    def _attach_orphans(self, block: Block):
+        """
+        add the orphans waiting for block and in turn their own children.
+        add_block of an attached orphan only pushes its children on the
+        worklist, so a long orphan chain is drained in a loop and not by
+        recursion, in the same depth first order
+        """
+        children = self._orphans.pop_children(block)
+        if self._orphan_worklist is not None:
+            self._orphan_worklist.extend(reversed(children))
+            return
+        self._orphan_worklist = worklist = list(reversed(children))
+        try:
+            while worklist:
+                self.add_block(worklist.pop())
+        finally:
+            self._orphan_worklist = None
 
     def _panic_validate_saved_blocks(self):
-        logger.debug("%s start panic validate orphan blocks", self._peer_id)
-        sorted_blocks = sorted(
-            self._missing_parent_blocks, key=lambda x: x.timestamp, reverse=False
+        """
+        orphans left at the end of the run, their parents never arrived
+        """
+        logger.debug(
+            "%s %s orphan blocks left, %s evicted",
+            self._peer_id,
+            len(self._orphans),
+            self._orphans.evicted,
         )
-        for block in sorted_blocks:
-            if self._validate_block(block):
-                self._add_block(block)
-                if self._longest_chain_length < self._branch_length(block):
-                    self._longest_chain_length = self._branch_length(block)
-                    self._longest_chain_leaf = block
+
+    def is_finalized(self, transaction: Transaction) -> bool:
+        """
+        transaction is in a finalized block of this peer
+        """
+        return transaction.finalized or transaction.txn_id in self._finalized_txn_ids
 
     def add_transaction(self, transaction: Transaction) -> bool:
         """
@@ -258,7 +435,12 @@ class BlockChainBase:
         #     self._generate_block()
 
     def _mine_block_start(self, block: Block):
-        delay = expon_distribution(self.avg_interval_time / self.cpu_power)
+        # one attempt at a time, a restart replaces the running one
+        if simulation.mining_scheduler:
+            simulation.mining_scheduler.start(self, block)
+            return
+        self._cancel_mining()
+        delay = expon_distribution(self.avg_interval_time / self.cpu_power, self.rng)
 
         mine_finish_event = Event(
             EventType.BLOCK_MINE_FINISH,
@@ -305,33 +487,94 @@ class BlockChainBase:
 
     def _cancel_mining(self):
         """cancel current running mine event"""
+        if simulation.mining_scheduler:
+            simulation.mining_scheduler.cancel(self)
         if self._current_mining_event:
             self._current_mining_event.cancel()
+            self._current_mining_event = None
 
     def generate_block(self):
         self._generate_block()
 
     def _get_chain(self, block):
-        chain = []
-        cur_block = block
-        while cur_block:
-            chain.append(cur_block)
-            cur_block = cur_block.prev_block
-        return chain
+        return self._index.chain(block)
+
+    def publish_withheld_blocks(self, broadcast: bool = True):
+        """
+        end of run: publish the blocks mined but not published yet, without
+        broadcast the caller delivers them (see merge_blocks)
+        """
+
+    def merge_blocks(self, blocks: list[Block]):
+        """
+        end of run reconciliation: add the blocks of blocks (parents first)
+        this peer is missing at once, no events are scheduled and the peer
+        does not react to them besides following the longest chain.
+        Finality advances once all are added, in between the tips of a
+        branch still being merged would not be protected.
+        """
+        for block in blocks:
+            if block in self._index or not self._validate_block(block):
+                continue
+            self._add_block(block, finalize=False)
+            self._merge_leaf(block)
+        if CONFIG.FINALITY_DEPTH is not None:
+            self._advance_finality()
 
-    def flush_blocks(self):
-        for block in self._blocks:
-            self.publish_block(block)
+    def _merge_leaf(self, block: Block):
+        chain_len_upto_block = self._branch_length(block)
+        if chain_len_upto_block > self._longest_chain_length:
+            self._longest_chain_length = chain_len_upto_block
+            self._longest_chain_leaf = block
 
     def publish_block(self, block: Block):
         self._broadcast_block(block)
+        self._release_block(block)
+
+    def _release_block(self, block: Block):
+        simulation.block_registry.mark_released(block, simulation.clock)
         block.is_private = False
 
     def get_longest_chain(self) -> list[Block]:
         return self._get_longest_chain()
 
+    def get_longest_chain_stats(self) -> tuple[int, int]:
+        """
+        length of the longest chain and how many of its blocks the owner mined
+        """
+        leaf = self._get_longest_chain_leaf()
+        return self._index.height(leaf), self._index.owned_upto(leaf)
+
+    def is_on_longest_chain(self, block: Block) -> bool:
+        return self._index.is_ancestor(block, self._get_longest_chain_leaf())
+
+    def common_ancestor(self, a: Block, b: Block) -> Block:
+        return self._index.common_ancestor(a, b)
+
+    def reorg_depth(self, old_tip: Block, new_tip: Block) -> int:
+        return self._index.reorg_depth(old_tip, new_tip)
+
+    def get_chain_metrics(self) -> ChainMetrics:
+        """
+        fork metrics, brought up to date with the current longest chain leaf
+        """
+        self._metrics.observe(self._index, self._get_longest_chain_leaf())
+        return self._metrics
+
+    def get_num_blocks_mined(self) -> int:
+        """
+        blocks of the owner in the block tree
+        """
+        return self._index.owned_total
+
     def get_blocks(self) -> list[Block]:
-        return self._blocks
+        return list(self._blocks)
+
+    def get_num_blocks(self) -> int:
+        """
+        blocks this peer accepted, including the ones pruned below finality
+        """
+        return len(self._blocks) + self._num_pruned_blocks
 
     def validate_block(self, block: Block) -> bool:
         return self._validate_block(block)
@@ -21,7 +21,6 @@ class HonestBlockChain(BlockChainBase):
         self._add_block(block)
 
         chain_len_upto_block = self._branch_length(block)
-        self._validate_saved_blocks()
         if chain_len_upto_block > self._longest_chain_length:
             logger.debug(
                 "%s <longest_chain> %s %s generating new block !!",
@@ -29,9 +28,19 @@ class HonestBlockChain(BlockChainBase):
                 str(self._longest_chain_length),
                 str(chain_len_upto_block),
             )
+            if block.prev_block != self._longest_chain_leaf and logger.isEnabledFor(
+                logging.INFO
+            ):
+                logger.info(
+                    "%s <reorg> depth %s to %s",
+                    self._peer_id,
+                    self.reorg_depth(self._longest_chain_leaf, block),
+                    block,
+                )
             self._longest_chain_length = chain_len_upto_block
             self._longest_chain_leaf = block
             self._generate_block()
+        self._attach_orphans(block)
 
     @property
     def _current_parent_block(self) -> Block:
@@ -71,5 +80,5 @@ class HonestBlockChain(BlockChainBase):
         )
         self._mine_block_start(new_block)
 
-    def _get_longest_chain(self):
-        return self._get_chain(self._longest_chain_leaf)
+    def _get_longest_chain_leaf(self) -> Block:
+        return self._longest_chain_leaf
@@ -38,8 +38,6 @@ class PrivateBlockChain(BlockChainBase):
 
         self._add_block(block)
 
-        self._validate_saved_blocks()
-
         if block.miner == self._peer_id:
             self._secret_chain_leaf = block
             self._update_lead()
@@ -47,8 +45,24 @@ class PrivateBlockChain(BlockChainBase):
             self._longest_chain_length = self._branch_length(block)
             self._longest_chain_leaf = block
             self._update_lead()
+        self._attach_orphans(block)
         self.plot_frame()
 
+    def publish_withheld_blocks(self, broadcast: bool = True):
+        for block in self.secret_blocks:
+            if broadcast:
+                self.publish_block(block)
+            else:
+                self._release_block(block)
+        self.secret_blocks = []
+        self.state = 0  # no lead left to release
+
+    def _merge_leaf(self, block: Block):
+        if block.miner == self._peer_id:
+            self._secret_chain_leaf = block
+        else:
+            super()._merge_leaf(block)
+
     def _mine_success_handler(self, block: Block):
         self.secret_blocks.append(block)
         self.add_block(block)
@@ -90,10 +104,20 @@ class PrivateBlockChain(BlockChainBase):
         )
         self._mine_block_start(new_block)
 
-    def _get_longest_chain(self):
-        chain1 = self._get_chain(self._longest_chain_leaf)
-        chain2 = self._get_chain(self._secret_chain_leaf)
-        return chain1 if len(chain1) > len(chain2) else chain2
+    def _get_longest_chain_leaf(self) -> Block:
+        public_len = self._branch_length(self._longest_chain_leaf)
+        secret_len = self._branch_length(self._secret_chain_leaf)
+        if public_len > secret_len:
+            return self._longest_chain_leaf
+        return self._secret_chain_leaf
+
+    def _finality_limit(self, final: Block) -> Block:
+        """
+        unpublished blocks are never finalized, they still have to be released
+        """
+        if self.secret_blocks:
+            return self._index.common_ancestor(final, self.secret_blocks[0].prev_block)
+        return final
 
     def _update_current_parent_block(self, block):
         """
@@ -119,8 +143,13 @@ class PrivateBlockChain(BlockChainBase):
             # reject the whole selfish branch
             # start mining on public branch
             # move to state 0
-            for block in self.secret_blocks:
+            for block in reversed(self.secret_blocks):
+                self._index.remove(block)
                 self._blocks.remove(block)
+                if simulation.trace_recorder:
+                    simulation.trace_recorder.record_removed(
+                        self._peer_id, block, simulation.clock
+                    )
             self.secret_blocks = []
             self._secret_chain_leaf = self._longest_chain_leaf
             self._update_current_parent_block(self._secret_chain_leaf)
@@ -128,7 +157,7 @@ class PrivateBlockChain(BlockChainBase):
 
         elif self.state == 0.5:
             # current state is 0' and some block mined or received
-            new_block = self._blocks[-1]
+            new_block = self._blocks.last()
             if new_block.miner == self._peer_id:
                 # if mine successful publish it and mine on that
                 block = self.secret_blocks.pop(0)
@@ -142,7 +171,7 @@ class PrivateBlockChain(BlockChainBase):
         elif self.state == 0:
             # current state is 0 and some block mined or received
             # start mining on last mined or received block
-            new_block = self._blocks[-1]
+            new_block = self._blocks.last()
             self._update_current_parent_block(new_block)
             if new_block.miner == self._peer_id:
                 self.state = 1
@@ -164,7 +193,7 @@ class PrivateBlockChain(BlockChainBase):
             self._update_current_parent_block(self._secret_chain_leaf)
 
         elif self.state > 2:
-            new_block = self._blocks[-1]
+            new_block = self._blocks.last()
             if new_block.miner == self._peer_id:
                 # go to t+1 state
                 self.state += 1
@@ -1,17 +1,24 @@
+import math
+import heapq
 import inspect
 from enum import Enum
 from queue import PriorityQueue
 from datetime import datetime, timedelta
 import logging
 import threading
-from time import sleep
+from collections import deque
+from time import sleep, perf_counter
 from tqdm import tqdm
 
 
-import utils as UITLS
+from profiler import EventProfiler
+from registry import BlockRegistry
 
 logger = logging.getLogger(__name__)
 
+# compact the event queue only once this many events are cancelled
+CANCELLED_COMPACT_MIN = 1000
+
 
 class EventType(Enum):
     TXN_CREATE = "TXN_CREATED"
@@ -44,7 +51,7 @@ class Event:
         payload,
         meta_description="",
     ):
-        self.id = UITLS.generate_random_id(6)
+        self.id: int = simulation.ids.next_id("event")
         self.type: EventType = event_type  # type of the event
         self.created_at = created_at  # when it is created
         self.delay = delay
@@ -56,21 +63,26 @@ class Event:
         self.meta_description = meta_description
         self.is_cancelled = False
 
-        self.owner = "nan"
+        # the creating object, formatted only when owner is read
+        self._owner = "nan"
         try:
-            caller_class = inspect.currentframe().f_back.f_locals["self"]
-            self.owner = caller_class
-            caller_class_name = caller_class.__class__.__name__
-            if caller_class_name == "BlockChain":
-                self.owner = f"{caller_class.peer_id}"
-            if caller_class_name == "OneWayLINK":
-                self.owner = f"{caller_class.from_peer}->{caller_class.to_peer}"
+            self._owner = inspect.currentframe().f_back.f_locals["self"]
         except Exception:
             try:
-                self.owner = inspect.currentframe().f_back.f_locals["module"]
+                self._owner = inspect.currentframe().f_back.f_locals["module"]
             except Exception:
                 pass
 
+    @property
+    def owner(self):
+        caller_class = self._owner
+        caller_class_name = caller_class.__class__.__name__
+        if caller_class_name == "BlockChain":
+            return f"{caller_class.peer_id}"
+        if caller_class_name == "OneWayLINK":
+            return f"{caller_class.from_peer}->{caller_class.to_peer}"
+        return caller_class
+
     def __gt__(self, other):
         return self.actionable_at > other.actionable_at
 
@@ -93,18 +105,118 @@ class Event:
 
     def cancel(self):
         """cancel the event from the event queue."""
-        self.is_cancelled = True
+        if not self.is_cancelled:
+            self.is_cancelled = True
+            simulation.count_cancelled()
+
+    def __getstate__(self):
+        """
+        store the action as a (target, attribute name) reference
+        so events can be checkpointed
+        """
+        state = self.__dict__.copy()
+        action = state.pop("action")
+        if inspect.ismethod(action):
+            state["action_ref"] = (action.__self__, method_attribute_name(action))
+        else:
+            state["action_ref"] = (None, action)
+        return state
+
+    def __setstate__(self, state):
+        target, action = state.pop("action_ref")
+        self.__dict__.update(state)
+        self.action = getattr(target, action) if target is not None else action
+
+
+def method_attribute_name(method) -> str:
+    """
+    attribute name a bound method is reachable under, undoing name mangling
+    of __private methods
+    """
+    name = method.__func__.__name__
+    if name.startswith("__") and not name.endswith("__"):
+        owner_class = method.__func__.__qualname__.rsplit(".", 2)[-2]
+        name = f"_{owner_class.lstrip('_')}{name}"
+    return name
+
+
+class IdAllocator:
+    """
+    Monotonic integer ids, one counter per kind of object ("event", "txn", "block").
+    Ids are unique and deterministic within a simulation; readable string forms
+    are only produced on export (utils.format_id).
+    """
+
+    def __init__(self):
+        self._next: dict[str, int] = {}
+        self._offset = 0
+        self._stride = 1
+
+    def register(self, kind: str, start: int = 0):
+        """
+        make ids of kind start at start, unless some were already handed out
+        """
+        self._next.setdefault(kind, start)
+
+    def partition(self, rank: int, size: int):
+        """
+        from now on only hand out ids that are rank modulo size,
+        so size processes continuing from the same state never collide
+        """
+        for kind, value in self._next.items():
+            self._next[kind] = value + (rank - value) % size
+        self._offset = rank
+        self._stride = size
+
+    def peek(self, kind: str) -> int:
+        """
+        the id next_id(kind) would hand out
+        """
+        return self._next.get(kind, self._offset)
+
+    def next_id(self, kind: str) -> int:
+        value = self._next.get(kind, self._offset)
+        self._next[kind] = value + self._stride
+        return value
 
 
 class Simulation:
     def __init__(self):
         self.clock = 0.0
         self.event_queue = PriorityQueue()
+        # events due at the current clock while running, FIFO, drained
+        # before the heap is looked at again
+        self.immediate: deque[Event] = deque()
+        self.running = False
         self.__run_hooks = []
         self.stop_sim = False
         self.force_stop = False
+        # leave the run loop after the current event, the rest stays queued
+        self.end_run = False
 
         self.blocks_created = 0
+        # cancelled events still in the queue, dropped lazily
+        self.cancelled_events = 0
+
+        self.ids = IdAllocator()
+        # every accepted block once, peers keep registry.BlockView
+        self.block_registry = BlockRegistry()
+
+        self.profiler: EventProfiler = None
+        self.trace_sink = None  # logger.EventTraceSink
+        self.trace_recorder = None  # eventtrace.TraceRecorder, binary trace
+        self.prune_sink = None  # blocks dropped below finality, same format
+
+        # fn(event) -> bool, takes events meant for another process, see pdes.py
+        self.router = None
+
+        # mining.MiningScheduler, one next block event for all miners
+        self.mining_scheduler = None
+
+        self.events_executed = 0
+        self.__checkpoint_fn = None
+        self.__checkpoint_interval = 0
+        self.__next_checkpoint = 0
 
         self.completed_event_counter = tqdm(
             desc="Completed: ",
@@ -124,8 +236,34 @@ class Simulation:
     def count_block_creation(self):
         self.blocks_created += 1
 
+    def count_cancelled(self):
+        """
+        Drop cancelled events from the queue once they make up most of it,
+        instead of sifting them through every later put / get.
+        """
+        self.cancelled_events += 1
+        if (
+            self.cancelled_events > CANCELLED_COMPACT_MIN
+            and self.cancelled_events * 2 > self.event_queue.qsize()
+        ):
+            with self.event_queue.mutex:
+                queue = [
+                    event for event in self.event_queue.queue if not event.is_cancelled
+                ]
+                heapq.heapify(queue)
+                self.event_queue.queue = queue
+            self.immediate = deque(
+                event for event in self.immediate if not event.is_cancelled
+            )
+            self.cancelled_events = 0
+
     def __enqueue(self, event):
-        self.event_queue.put(event)
+        if self.router is not None and self.router(event):
+            return
+        if self.running and event.actionable_at <= self.clock:
+            self.immediate.append(event)
+        else:
+            self.event_queue.put(event)
         self.scheduled_event_counter.update(1)
         # logger.debug("Scheduled: %s", event)
         # logger.info(f"Event payload: {event.payload}\n")
@@ -142,6 +280,108 @@ class Simulation:
             return
         self.__enqueue(event)
 
+    def enqueue_many(self, events: list[Event]):
+        """
+        Enqueue a batch of events (a broadcast fan out) under one lock,
+        merged into the heap with one heapify when the batch is large
+        compared to the queue, pushed one by one otherwise.
+        """
+        if self.stop_sim:
+            events = [event for event in events if event.type == EventType.BLOCK_RECEIVE]
+        if self.router is not None:
+            events = [event for event in events if not self.router(event)]
+        batch = []
+        for event in events:
+            if self.running and event.actionable_at <= self.clock:
+                self.immediate.append(event)
+            else:
+                batch.append(event)
+        if batch:
+            with self.event_queue.mutex:
+                queue = self.event_queue.queue
+                if len(batch) * 8 > len(queue):
+                    queue.extend(batch)
+                    heapq.heapify(queue)
+                else:
+                    for event in batch:
+                        heapq.heappush(queue, event)
+                self.event_queue.unfinished_tasks += len(batch)
+                self.event_queue.not_empty.notify(len(batch))
+        self.scheduled_event_counter.update(len(events))
+
+    def enable_profiling(self, rate_interval: float = 1.0) -> EventProfiler:
+        """
+        Record count, wall time and queue depth per event type and handler.
+        """
+        self.profiler = EventProfiler(rate_interval)
+        return self.profiler
+
+    def set_trace_sink(self, sink):
+        """
+        Emit a structured record for every executed event to sink.
+        """
+        self.trace_sink = sink
+
+    def set_checkpointing(self, fn, interval: int):
+        """
+        Call fn() every interval executed events, between two events,
+        when the state is consistent.
+        """
+        self.__checkpoint_fn = fn
+        self.__checkpoint_interval = interval
+        self.__next_checkpoint = self.events_executed + interval
+
+    @property
+    def checkpointing(self) -> bool:
+        return self.__checkpoint_fn is not None
+
+    def __maybe_checkpoint(self):
+        if self.events_executed >= self.__next_checkpoint:
+            self.__next_checkpoint = self.events_executed + self.__checkpoint_interval
+            self.__checkpoint_fn()
+
+    def get_state(self) -> dict:
+        """
+        everything needed to continue the run later, see checkpoint.py
+        """
+        return {
+            "clock": self.clock,
+            "event_queue": list(self.event_queue.queue),
+            "immediate": list(self.immediate),
+            "ids": self.ids,
+            "block_registry": self.block_registry,
+            "stop_sim": self.stop_sim,
+            "blocks_created": self.blocks_created,
+            "events_executed": self.events_executed,
+            "cancelled_events": self.cancelled_events,
+            "mining_scheduler": self.mining_scheduler,
+        }
+
+    def set_state(self, state: dict):
+        self.clock = state["clock"]
+        with self.event_queue.mutex:
+            self.event_queue.queue = state["event_queue"]
+        self.immediate = deque(state.get("immediate", ()))
+        self.ids = state["ids"]
+        self.block_registry = state["block_registry"]
+        self.stop_sim = state["stop_sim"]
+        self.blocks_created = state["blocks_created"]
+        self.events_executed = state["events_executed"]
+        self.cancelled_events = state["cancelled_events"]
+        self.mining_scheduler = state["mining_scheduler"]
+        self.completed_event_counter.n = self.events_executed
+        self.scheduled_event_counter.update(len(state["event_queue"]))
+
+    def next_event_time(self) -> float:
+        """
+        actionable time of the earliest pending event, inf if there is none
+        """
+        if self.immediate:
+            return self.clock
+        if self.event_queue.empty():
+            return math.inf
+        return self.event_queue.queue[0].actionable_at
+
     def reg_run_hooks(self, fn):
         """
         Register a function to be called before running an event.
@@ -160,10 +400,23 @@ class Simulation:
         if self.force_stop:
             return
         if event.type in [EventType.TXN_SEND, EventType.BLOCK_SEND]:
-            logger.debug("Running: %s", event)
-            logger.debug("Details: %s", event.description())
-        else:
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("Running: %s", event)
+                logger.debug("Details: %s", event.description())
+        elif logger.isEnabledFor(logging.INFO):
             logger.info("Running: %s", event)
+        if self.trace_sink:
+            self.trace_sink.emit(
+                {
+                    "id": event.id,
+                    "type": event.type.name,
+                    "owner": str(event.owner),
+                    "created_at": event.created_at,
+                    "actionable_at": event.actionable_at,
+                }
+            )
+        if self.trace_recorder:
+            self.trace_recorder.record_event(event)
 
         if self.stop_sim and event.type == EventType.BLOCK_RECEIVE:
             event.action(*event.payload)
@@ -171,23 +424,71 @@ class Simulation:
 
         event.action(*event.payload)
 
-    def __run_loop(self):
-        while not self.event_queue.empty() and not self.force_stop:
-            next_event = self.event_queue.get()
+    def __next_event(self, until: float) -> Event:
+        """
+        the next event to run, None when nothing is due before until
+        """
+        if self.immediate:
+            return self.immediate.popleft()
+        if self.event_queue.empty() or self.event_queue.queue[0].actionable_at >= until:
+            return None
+        return self.event_queue.get()
+
+    def __run_loop(self, until: float):
+        while not (self.force_stop or self.end_run):
+            next_event = self.__next_event(until)
+            if next_event is None:
+                break
+            if next_event.is_cancelled:
+                self.cancelled_events -= 1
+                continue
+            self.clock = next_event.actionable_at
+            self.__run_event(next_event)
+
+            self.completed_event_counter.update(1)
+            self.events_executed += 1
+            if self.__checkpoint_fn:
+                self.__maybe_checkpoint()
+
+    def __run_loop_profiled(self, until: float):
+        profiler = self.profiler
+        if profiler.start_time is None:
+            profiler.start()
+        while not (self.force_stop or self.end_run):
+            next_event = self.__next_event(until)
+            if next_event is None:
+                break
             if next_event.is_cancelled:
+                self.cancelled_events -= 1
                 continue
             self.clock = next_event.actionable_at
+            queue_depth = self.event_queue.qsize() + len(self.immediate)
+            start = perf_counter()
             self.__run_event(next_event)
+            now = perf_counter()
+            profiler.record(next_event, now - start, queue_depth, self.clock, now)
 
             self.completed_event_counter.update(1)
+            self.events_executed += 1
+            if self.__checkpoint_fn:
+                self.__maybe_checkpoint()
+        profiler.stop()
 
-    def run(self):
+    def run(self, until: float = math.inf):
         """
         Start the simulation.
+        until: only run events scheduled before this time, the rest stay queued
         """
         # self.is_running = True
         # self.__dequeue_timer()
-        self.__run_loop()
+        self.running = True
+        try:
+            if self.profiler:
+                self.__run_loop_profiled(until)
+            else:
+                self.__run_loop(until)
+        finally:
+            self.running = False
 
 
 simulation = Simulation()
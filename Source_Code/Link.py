@@ -4,7 +4,8 @@ from typing import Union
 from Transaction import Transaction
 from Block import Block
 from DiscreteEventSim import simulation, Event, EventType
-from utils import expon_distribution
+from utils import expon_distribution, spawn_rng
+from config import CONFIG
 
 
 class OneWayLINK:
@@ -13,14 +14,20 @@ class OneWayLINK:
         self.to_peer = to_peer
         self.pij = pij
         self.cij = cij
-        self.transmitted_messages = []
+        self.transmitted_messages = set()
+        self.rng = spawn_rng()  # queuing delays
+        # txns waiting for the next batch, see CONFIG.TXN_RELAY_WINDOW
+        self.pending_txns: list[Transaction] = []
 
-    def __get_delay(self, message: Union[Transaction, Block]):
-        dij = expon_distribution((96 / 8) / self.cij)  # ms
-        return self.pij + message.size / self.cij + dij  # ms
+    def __get_delay(self, size: float):
+        dij = expon_distribution((96 / 8) / self.cij, self.rng)  # ms
+        return self.pij + size / self.cij + dij  # ms
 
-    def __link_delay_sim(self, message: Union[Transaction, Block]):
-        delay = self.__get_delay(message)
+    def _message_delay(self, message: Union[Transaction, Block]) -> float:
+        return self.__get_delay(message.size)
+
+    def __delivery_event(self, message: Union[Transaction, Block]) -> Event:
+        delay = self._message_delay(message)
         event_type = (
             EventType.TXN_RECEIVE
             if isinstance(message, Transaction)
@@ -29,7 +36,7 @@ class OneWayLINK:
         event_description = (
             f"{self.from_peer}->{self.to_peer}*; {message}; Δ:{round(delay,4)}ms"
         )
-        receive_msg_event = Event(
+        return Event(
             event_type,
             simulation.clock,
             delay,
@@ -37,16 +44,63 @@ class OneWayLINK:
             (message, self.from_peer),
             event_description,
         )
-        simulation.enqueue(receive_msg_event)
+
+    def delivery(self, message: Union[Transaction, Block]) -> Event:
+        """
+        The receive event of message at the other peer, not yet enqueued.
+        None if the message was already sent on this link.
+        """
+        if message in self.transmitted_messages:
+            return None
+        self.transmitted_messages.add(message)
+        if CONFIG.TXN_RELAY_WINDOW is not None and isinstance(message, Transaction):
+            self.__queue_txn(message)
+            return None
+        return self.__delivery_event(message)
+
+    def __queue_txn(self, txn: Transaction):
+        """
+        hold txn for the batch sent at the end of the current relay window
+        """
+        if not self.pending_txns:
+            simulation.enqueue(
+                Event(
+                    EventType.TXN_SEND,
+                    simulation.clock,
+                    CONFIG.TXN_RELAY_WINDOW,
+                    self.send_txn_batch,
+                    (),
+                    f"{self.from_peer}->{self.to_peer}* txn batch",
+                )
+            )
+        self.pending_txns.append(txn)
+
+    def send_txn_batch(self):
+        """
+        one receive event for all txns held during the window,
+        delayed by their combined size
+        """
+        txns = tuple(self.pending_txns)
+        self.pending_txns = []
+        delay = self.__get_delay(sum(txn.size for txn in txns))
+        simulation.enqueue(
+            Event(
+                EventType.TXN_RECEIVE,
+                simulation.clock,
+                delay,
+                self.to_peer.receive_txns,
+                (txns, self.from_peer),
+                f"{self.from_peer}->{self.to_peer}*; {len(txns)} txns; Δ:{round(delay,4)}ms",
+            )
+        )
 
     def transmit(self, message: Union[Transaction, Block]):
         """
         Transmit a message to the other peer.
         """
-        if message in self.transmitted_messages:
-            return
-        self.transmitted_messages.append(message)
-        self.__link_delay_sim(message)
+        event = self.delivery(message)
+        if event is not None:
+            simulation.enqueue(event)
 
     def __repr__(self) -> str:
         return f"Link({self.from_peer}->{self.to_peer})"
@@ -68,16 +122,20 @@ class Link:
             from_peer=peer2, to_peer=peer1, pij=self.pij, cij=self.cij
         )
 
+    def get_one_way(self, peer: "Peer") -> OneWayLINK:
+        """
+        the one way link sending from peer
+        """
+        return self.link1 if peer == self.peer1 else self.link2
+
     def get_link(self, peer: "Peer"):
         """
-        Get the one way link object for the given peer.
+        Get the delivery function of the one way link sending from peer.
         """
-        link = self.link1 if peer == self.peer1 else self.link2
-        return link.transmit
+        return self.get_one_way(peer).delivery
 
     def __repr__(self):
         return f"Link({self.peer1}<->{self.peer2})"
 
-    @property
-    def __dict__(self) -> dict:
+    def to_dict(self) -> dict:
         return {"pij": self.pij, "cij": self.cij}
@@ -1,4 +1,3 @@
-import numpy as np
 import random
 import logging
 from copy import deepcopy
@@ -6,7 +5,7 @@ from typing import Union
 
 from Transaction import Transaction
 from Block import Block
-from utils import expon_distribution, generate_random_id
+from utils import expon_distribution, spawn_rng
 from BlockChainBase import BlockChainBase
 from BlockChainHonest import HonestBlockChain
 from BlockChainSecret import PrivateBlockChain
@@ -19,20 +18,42 @@ logger = logging.getLogger(__name__)
 
 
 class Peer:
+    __slots__ = (
+        "id",
+        "is_slow_network",
+        "is_slow_cpu",
+        "crypto_coins",
+        "neighbours",
+        "neighbours_meta",
+        "_neighbour_peers",
+        "_deliveries",
+        "_forward_tables",
+        "cpu_power",
+        "block_chain",
+        "type",
+        "forwarded_messages",
+        "rng",
+    )
 
     def __init__(self, id, cpu_power=0, is_slow_network=False, is_slow_cpu=True):
-        # self.id: int = id
-        self.id: str = generate_random_id(3)
+        self.id: int = id
         self.is_slow_network: bool = is_slow_network
         self.is_slow_cpu: bool = is_slow_cpu
         self.crypto_coins: int = CONFIG.INITIAL_COINS
         self.neighbours: dict["Peer", any] = {}
         self.neighbours_meta: dict["Peer", Link] = {}
+        # derived from neighbours by _update_forwarding: the neighbours and
+        # their delivery functions in the same order, and per source
+        # neighbour the deliveries to every other neighbour
+        self._neighbour_peers: tuple["Peer", ...] = ()
+        self._deliveries: tuple = ()
+        self._forward_tables: dict["Peer", tuple] = {}
         self.cpu_power: float = cpu_power
         self.block_chain: BlockChainBase = None
         self.type = "HonestPeer"
 
-        self.forwarded_messages: list[Union[Transaction, Block]] = []
+        self.forwarded_messages: set[Union[Transaction, Block]] = set()
+        self.rng = spawn_rng()  # transaction receivers and amounts
 
     @property
     def cpu_net_description(self):
@@ -46,13 +67,35 @@ class Peer:
         # self.connected_peers.append(peer)
         self.neighbours[peer] = link.get_link(self)
         self.neighbours_meta[peer] = link
+        self._update_forwarding()
+
+    def _update_forwarding(self):
+        """
+        rebuild the forwarding tables, so relaying a message filters or
+        looks up nothing per neighbour
+        """
+        self._neighbour_peers = tuple(self.neighbours)
+        deliveries = tuple(self.neighbours.values())
+        self._deliveries = deliveries
+        self._forward_tables = {
+            peer: deliveries[:i] + deliveries[i + 1 :]
+            for i, peer in enumerate(self._neighbour_peers)
+        }
+
+    def forget_messages(self, messages: list[Union[Transaction, Block]]):
+        """
+        drop dedup entries of messages that can no longer arrive (finalized)
+        """
+        self.forwarded_messages.difference_update(messages)
+        for link in self.neighbours_meta.values():
+            link.get_one_way(self).transmitted_messages.difference_update(messages)
 
     def disconnect(self, peer):
         # self.connected_peers.remove(peer)
         self.neighbours.pop(peer)
+        self._update_forwarding()
 
-    @property
-    def __dict__(self) -> dict:
+    def to_dict(self) -> dict:
         return {
             "id": self.id,
             "name": self.__repr__(),
@@ -61,10 +104,10 @@ class Peer:
             "is_slow_cpu": self.is_slow_cpu,
             "crypto_coins": self.crypto_coins,
             "neighbours": [
-                {neighbour.__repr__(): link.__dict__}
+                {neighbour.__repr__(): link.to_dict()}
                 for (neighbour, link) in self.neighbours_meta.items()
             ],
-            "block_chain": self.block_chain.__dict__,
+            "block_chain": self.block_chain.to_dict(),
             "cpu_net_description": self.cpu_net_description,
             "type": self.type,
         }
@@ -75,29 +118,28 @@ class Peer:
     def __repr__(self):
         return f"Peer(id={self.id})"
 
-    def __forward_msg_to_peer(self, msg: Union[Transaction, Block], peer: "Peer"):
-        self.neighbours[peer](msg)
-
-    def __forward_msg_to_peers(
-        self, msg: Union[Transaction, Block], peers: list["Peer"]
-    ):
+    def __forward_msg_to_peers(self, msg: Union[Transaction, Block], deliveries: tuple):
         """
-        Forward a message to given peers.
+        Forward a message over the given delivery functions (links).
         """
         if msg in self.forwarded_messages:
             return
-        self.forwarded_messages.append(msg)
+        self.forwarded_messages.add(msg)
 
-        for peer in peers:
-            self.__forward_msg_to_peer(msg, peer)
+        events = []
+        for deliver in deliveries:
+            event = deliver(msg)
+            if event is not None:
+                events.append(event)
+        simulation.enqueue_many(events)
 
     @property
-    def connected_peers(self):
-        return list(self.neighbours.keys())
+    def connected_peers(self) -> tuple["Peer", ...]:
+        return self._neighbour_peers
 
     def __create_txn(self, timestamp):
-        to_peer = np.random.choice(self.connected_peers)
-        amount = random.uniform(0, self.crypto_coins)
+        to_peer = self.rng.choice(self._neighbour_peers)
+        amount = self.rng.uniform(0, self.crypto_coins)
         self.crypto_coins -= amount
         return Transaction(self, to_peer, amount, timestamp)
 
@@ -120,20 +162,29 @@ class Peer:
             return
 
         if isinstance(msg, Transaction):
+            if self.block_chain.is_finalized(msg):
+                return  # a late copy, the dedup entry went with finality
             self.block_chain.add_transaction(msg)
         else:
             # logger.debug(f"Received block: {str(msg)}")
             self.block_chain.add_block(msg)
 
         self.__forward_msg_to_peers(
-            msg, list(filter(lambda x: x != source, self.connected_peers))
+            msg, self._forward_tables.get(source, self._deliveries)
         )
 
+    def receive_txns(self, txns: tuple[Transaction], source: "Peer"):
+        """
+        Receive a batch of transactions (CONFIG.TXN_RELAY_WINDOW).
+        """
+        for txn in txns:
+            self.receive_msg(txn, source)
+
     def broadcast_msg(self, msg: Union[Transaction, Block]):
         """
         Broadcast a message to all connected peers.
         """
-        self.__forward_msg_to_peers(msg, self.connected_peers)
+        self.__forward_msg_to_peers(msg, self._deliveries)
 
     def broadcast_txn(self, txn):
         """
@@ -147,8 +198,8 @@ class Peer:
         """
         self.broadcast_msg(block)
 
-    def flush_blocks(self):
-        self.block_chain.flush_blocks()
+    def publish_withheld_blocks(self, broadcast: bool = True):
+        self.block_chain.publish_withheld_blocks(broadcast)
 
 
 class HonestPeer(Peer):
@@ -156,6 +207,8 @@ class HonestPeer(Peer):
     Honest peer
     """
 
+    __slots__ = ()
+
     def __init__(self, id, is_slow_network=False, cpu_power=0):
         super().__init__(id, cpu_power, is_slow_network, True)
 
@@ -179,6 +232,8 @@ class SelfishPeer(Peer):
     selfish peer
     """
 
+    __slots__ = ()
+
     def __init__(self, id, is_slow_network=False, cpu_power=0):
         super().__init__(id, cpu_power, is_slow_network, False)
         self.type = "SelfishPeer"
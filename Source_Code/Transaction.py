@@ -1,26 +1,31 @@
-from utils import generate_random_id
 import logging
 
-from DiscreteEventSim import EventType
+from DiscreteEventSim import simulation, EventType
+from utils import format_id
 
 logger = logging.getLogger(__name__)
 
 
 class Transaction:
+    __slots__ = ("txn_id", "from_id", "to_id", "amount", "timestamp", "finalized")
+
+    size: int = 1  # KB
+
     def __init__(self, from_id, to_id, amount, timestamp):
-        self.txn_id: str = generate_random_id(6)
+        self.txn_id: int = simulation.ids.next_id("txn")
         self.from_id: "Peer" = from_id
         self.to_id: "Peer" = to_id
         self.amount: float = amount
         self.timestamp: float = timestamp
-        self.size: int = 1  # KB
+        # in a block every peer finalized (BlockRegistry.track_final)
+        self.finalized: bool = False
 
-        logger.debug(f"{self} <{EventType.TXN_CREATE}>: {self.description()}")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("%s <%s>: %s", self, EventType.TXN_CREATE, self.description())
 
-    @property
-    def __dict__(self) -> dict:
+    def to_dict(self) -> dict:
         return {
-            "txn_id": self.txn_id,
+            "txn_id": format_id("T", self.txn_id),
             "from_id": self.from_id.__repr__(),
             "to_id": self.to_id.__repr__(),
             "amount": self.amount,
@@ -35,10 +40,14 @@ class Transaction:
 
 
 class CoinBaseTransaction(Transaction):
+    __slots__ = ()
+
     def __init__(self, to_id, timestamp):
         super().__init__(from_id=None, to_id=to_id, amount=50, timestamp=timestamp)
-        logger.debug(
-            f"{self} coinbase <{EventType.TXN_CREATE}>: {self.description()}")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(
+                "%s coinbase <%s>: %s", self, EventType.TXN_CREATE, self.description()
+            )
 
     def description(self) -> str:
         return (f"CoinBase(id:{self.txn_id} to:{(self.to_id)}, :{self.amount}, 󰔛:{self.timestamp})")
@@ -0,0 +1,78 @@
+"""
+Import time benchmark for the simulation modules.
+
+Imports every module in a fresh interpreter (python -X importtime), reports
+the median cumulative import time over a few runs and fails if the plotting
+stack (visualisation, matplotlib, networkx, pygraphviz) ends up on the import
+path of the core simulation, or if an import takes longer than --budget ms.
+
+Usage: python bench_imports.py --runs 5 --budget 500
+"""
+
+import sys
+import argparse
+import statistics
+import subprocess
+
+CORE_MODULES = ["simulation", "montecarlo", "pdes", "checkpoint"]
+PLOTTING_MODULES = ["visualisation", "matplotlib", "networkx", "pygraphviz"]
+
+
+def import_once(module: str) -> tuple[float, list[str]]:
+    """
+    cumulative import time of module in ms and the plotting modules it loaded
+    """
+    check = (
+        f"import sys, {module}; "
+        f"print(' '.join(m for m in {PLOTTING_MODULES!r} if m in sys.modules))"
+    )
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", check],
+        capture_output=True,
+        text=True,
+    )
+    if result.returncode:
+        raise RuntimeError(f"importing {module} failed:\n{result.stderr}")
+    cumulative_us = 0
+    for line in result.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith("import time:"):
+            continue
+        _, cumulative, name = line[len("import time:") :].split("|")
+        if name.strip() == module:
+            cumulative_us = int(cumulative)
+    return cumulative_us / 1000, result.stdout.split()
+
+
+def benchmark(modules: list[str], runs: int) -> dict[str, dict]:
+    results = {}
+    for module in modules:
+        times, loaded = [], []
+        for _ in range(runs):
+            elapsed, loaded = import_once(module)
+            times.append(elapsed)
+        results[module] = {"median_ms": statistics.median(times), "plotting": loaded}
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("modules", nargs="*", default=CORE_MODULES)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--budget", type=float, default=None, help="ms per module")
+    args = parser.parse_args()
+
+    failed = False
+    for module, result in benchmark(args.modules, args.runs).items():
+        problems = []
+        if result["plotting"]:
+            problems.append(f"imports {', '.join(result['plotting'])}")
+        if args.budget is not None and result["median_ms"] > args.budget:
+            problems.append(f"over budget ({args.budget} ms)")
+        failed |= bool(problems)
+        print(f"{module:<12} {result['median_ms']:8.1f} ms  {'; '.join(problems)}")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
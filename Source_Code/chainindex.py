@@ -0,0 +1,144 @@
+from typing import Any
+from array import array
+
+from Block import Block
+from registry import BlockView, _grow
+
+
+class ChainIndex:
+    """
+    Tip index of one peer's block tree, maintained on insertion:
+    how many blocks of the owning peer lie on the branch up to every block,
+    the current leaves and the longest leaf. Heights (the genesis block has
+    height 1, as in _branch_length) come from the block registry. Chain
+    lengths, leads and per peer counts on a branch are then O(1); the blocks
+    of a branch are only walked when it is exported.
+
+    Every block also has one skip pointer in the registry (skew binary jump
+    pointers, Myers 1983): jump[b] is either the parent or jump[jump[parent]],
+    chosen so that any ancestor is reached in O(log height) steps. k-th
+    ancestor, common ancestor and is-ancestor queries use them instead of
+    walking prev_block.
+    """
+
+    def __init__(self, owner: Any, view: BlockView, genesis: Block):
+        self.owner = owner
+        self.view = view
+        self.registry = view.registry
+        # per registry index from view.offset on, only meaningful for blocks in view
+        self.owned = array("i", [0])
+        self.children = array("i", [0])
+        self.tips: set[Block] = {genesis}
+        self.longest: Block = genesis
+        self.owned_total = 0  # blocks of owner in the tree
+
+    def __contains__(self, block: Block) -> bool:
+        return block in self.view
+
+    def __len__(self) -> int:
+        return len(self.view)
+
+    def height(self, block: Block) -> int:
+        return self.registry.height[block.index - self.registry.base]
+
+    def owned_upto(self, block: Block) -> int:
+        return self.owned[block.index - self.view.offset]
+
+    def add(self, block: Block):
+        """
+        block was just added to view
+        """
+        parent = block.prev_block
+        offset = self.view.offset
+        index = block.index - offset
+        is_owned = block.miner is self.owner
+        _grow(self.owned, index + 1, 0)
+        _grow(self.children, index + 1, 0)
+        self.owned[index] = self.owned[parent.index - offset] + is_owned
+        self.children[index] = 0
+        self.children[parent.index - offset] += 1
+        self.tips.discard(parent)
+        self.tips.add(block)
+        self.owned_total += is_owned
+        if self.height(block) > self.height(self.longest):
+            self.longest = block
+
+    def remove(self, block: Block):
+        """
+        drop a leaf (abandoned private blocks), before removing it from view
+        """
+        parent = block.prev_block
+        self.tips.discard(block)
+        if parent in self.view:
+            self.children[parent.index - self.view.offset] -= 1
+            if not self.children[parent.index - self.view.offset]:
+                self.tips.add(parent)
+        self.owned_total -= block.miner is self.owner
+        if block == self.longest:
+            self.longest = max(
+                (tip for tip in self.tips if tip is not block),
+                key=lambda tip: (self.height(tip), -tip.block_id),
+            )
+
+    def prunable(self, final: Block) -> list[Block]:
+        """
+        blocks that do not descend from final: its ancestors and side
+        branches forking below it
+        """
+        height = self.height(final)
+        return [
+            block
+            for block in self.view
+            if block is not final
+            and (self.height(block) <= height or not self.is_ancestor(final, block))
+        ]
+
+    def prune(self, dropped: list[Block]):
+        """
+        drop blocks from the index and the view,
+        counts already taken (owned_total) stay
+        """
+        for block in dropped:
+            self.tips.discard(block)
+        shift = self.view.drop(dropped)
+        del self.owned[:shift]
+        del self.children[:shift]
+        if self.longest in dropped:
+            self.longest = max(self.tips, key=lambda tip: (self.height(tip), -tip.block_id))
+
+    def chain(self, block: Block) -> list[Block]:
+        """
+        blocks from block back to the genesis block, or to the block every
+        peer finalized (BlockRegistry.track_final)
+        """
+        chain = []
+        while block:
+            chain.append(block)
+            block = block.prev_block
+        return chain
+
+    def ancestor_at(self, block: Block, height: int) -> Block:
+        """
+        ancestor of block at the given height, None above block
+        """
+        if height > self.height(block) or height < 1:
+            return None
+        return self.registry.block(self.registry.ancestor_index(block.index, height))
+
+    def kth_ancestor(self, block: Block, k: int) -> Block:
+        return self.ancestor_at(block, self.height(block) - k)
+
+    def is_ancestor(self, ancestor: Block, block: Block) -> bool:
+        """
+        ancestor lies on the branch up to block (a block is its own ancestor)
+        """
+        return self.ancestor_at(block, self.height(ancestor)) is ancestor
+
+    def common_ancestor(self, a: Block, b: Block) -> Block:
+        return self.registry.common_ancestor(a, b)
+
+    def reorg_depth(self, old_tip: Block, new_tip: Block) -> int:
+        """
+        blocks of old_tip's branch abandoned by switching to new_tip
+        """
+        return self.height(old_tip) - self.height(self.common_ancestor(old_tip, new_tip))
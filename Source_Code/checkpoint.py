@@ -0,0 +1,135 @@
+import os
+import sys
+import gzip
+import pickle
+import random
+import logging
+
+import numpy as np
+
+from Block import Block, GENESIS_BLOCK, GENESIS_BLOCK_ID
+from DiscreteEventSim import simulation
+
+logger = logging.getLogger(__name__)
+
+# peers reference each other through neighbours and links,
+# pickling them recurses a few frames per peer
+RECURSION_PER_PEER = 20
+
+
+class CheckpointPickler(pickle.Pickler):
+    """
+    Pickles every Block as a reference to its id, the blocks themselves are
+    written afterwards as flat rows. Without this a chain of n blocks
+    recurses n levels deep through prev_block.
+    """
+
+    def __init__(self, file):
+        super().__init__(file, protocol=pickle.HIGHEST_PROTOCOL)
+        self.blocks: dict[int, Block] = {}
+
+    def persistent_id(self, obj):
+        if type(obj) is not Block:
+            return None
+        if obj.block_id != GENESIS_BLOCK_ID:
+            self.blocks.setdefault(obj.block_id, obj)
+        return obj.block_id
+
+    def dump_blocks(self):
+        """
+        write rows for every block referenced so far, and for the ones
+        those rows reference, then a terminating None
+        """
+        written = set()
+        while len(written) < len(self.blocks):
+            batch = [
+                block
+                for block_id, block in self.blocks.items()
+                if block_id not in written
+            ]
+            written.update(block.block_id for block in batch)
+            self.dump(
+                [
+                    tuple(getattr(block, slot) for slot in Block.__slots__)
+                    for block in batch
+                ]
+            )
+        self.dump(None)
+
+
+class CheckpointUnpickler(pickle.Unpickler):
+    def __init__(self, file):
+        super().__init__(file)
+        self.blocks: dict[int, Block] = {}
+
+    def persistent_load(self, block_id):
+        if block_id == GENESIS_BLOCK_ID:
+            return GENESIS_BLOCK
+        block = self.blocks.get(block_id)
+        if block is None:
+            # filled in by load_blocks, the id is set now since it is the hash
+            block = self.blocks[block_id] = Block.__new__(Block)
+            block.block_id = block_id
+        return block
+
+    def load_blocks(self):
+        while (rows := self.load()) is not None:
+            for row in rows:
+                block = self.persistent_load(row[0])
+                for slot, value in zip(Block.__slots__, row):
+                    setattr(block, slot, value)
+
+
+def save_checkpoint(path: str, peers: list, extra: dict = None):
+    """
+    Write the full simulation state to a gzip compressed pickle:
+    clock, pending events, id counters, peers with their block chains and
+    mempools, and the python / numpy RNG states.
+    The file is written next to path first and then renamed over it,
+    a crash while saving keeps the previous checkpoint.
+    """
+    state = {
+        "simulation": simulation.get_state(),
+        "peers": peers,
+        "random_state": random.getstate(),
+        "np_random_state": np.random.get_state(),
+        "extra": extra or {},
+    }
+    recursion_limit = sys.getrecursionlimit()
+    sys.setrecursionlimit(max(recursion_limit, RECURSION_PER_PEER * len(peers)))
+    try:
+        tmp_path = f"{path}.tmp"
+        with gzip.open(tmp_path, "wb", compresslevel=3) as f:
+            pickler = CheckpointPickler(f)
+            pickler.dump(state)
+            pickler.dump_blocks()
+        os.replace(tmp_path, path)
+    finally:
+        sys.setrecursionlimit(recursion_limit)
+    logger.info(
+        "checkpoint saved %s at clock %s after %s events",
+        path,
+        simulation.clock,
+        simulation.events_executed,
+    )
+
+
+def load_checkpoint(path: str) -> tuple[list, dict]:
+    """
+    Restore the state written by save_checkpoint into the simulation.
+    Returns the peers and the extra dict.
+    """
+    with gzip.open(path, "rb") as f:
+        unpickler = CheckpointUnpickler(f)
+        state = unpickler.load()
+        unpickler.load_blocks()
+    simulation.set_state(state["simulation"])
+    random.setstate(state["random_state"])
+    np.random.set_state(state["np_random_state"])
+    logger.info(
+        "checkpoint loaded %s at clock %s after %s events",
+        path,
+        simulation.clock,
+        simulation.events_executed,
+    )
+    return state["peers"], state["extra"]
@@ -8,6 +8,8 @@ class Config:
     ## below parameters are unchanged for all the experiments
 
     SAVE_RESULTS = True
+    # svg frames and graphs per peer, needs requirements-viz.txt
+    VISUALIZE = True
 
     Z0 = 0.5  # network z0 is slow
 
@@ -26,6 +28,73 @@ class Config:
 
     NUMBER_OF_TRANSACTIONS = MAX_NUM_BLOCKS * BLOCK_TXNS_TARGET_THRESHOLD
 
+    SEED = None  # seed python and numpy RNGs for reproducible runs
+    MAX_SIM_TIME = None  # also stop at this simulation time (ms)
+
+    # hybrid fidelity (hybrid.py): full runs write their block propagation
+    # delays to PROPAGATION_FILE, with HONEST_POOLS set the honest peers are
+    # replaced by that many pools whose block delays are drawn from it
+    PROPAGATION_FILE = None  # e.g. "propagation.json"
+    HONEST_POOLS = None
+
+    # relay txns per link in one batch every this many ms (inv trickling),
+    # None sends every txn as its own message
+    TXN_RELAY_WINDOW = None
+
+    # blocks received before their parent
+    ORPHAN_POOL_SIZE = 1000  # per peer, oldest evicted first
+    ORPHAN_TIMEOUT = 20 * AVG_BLOCK_MINING_TIME  # ms, None keeps them until the end
+
+    # finality: blocks this deep below the longest tip are final, balances up
+    # to them are snapshotted and older blocks dropped from memory.
+    # None keeps every block. Should be well above the selfish lead: a branch
+    # released after its fork point is final is rejected like any deep reorg.
+    # Blocks every peer finalized are cut from their parents, exported chains
+    # start at the latest of them (BlockRegistry.track_final)
+    FINALITY_DEPTH = None
+    FINALITY_SPILL_FILE = None  # e.g. "pruned_blocks.jsonl", pruned blocks per peer
+
+    # sample the next block over all miners (mining.py) instead of
+    # one mining event per peer
+    GLOBAL_MINING_SCHEDULER = False
+
+    # > 1 runs peers in that many processes (pdes.py)
+    PARALLEL_WORKERS = 1
+
+    # checkpointing, resume with `python simulation.py --resume`
+    CHECKPOINT_FILE = "checkpoint.pkl.gz"
+    CHECKPOINT_INTERVAL = 0  # executed events between checkpoints, 0 disables
+
+    # logging
+    LOG_LEVEL = "WARNING"  # DEBUG / INFO enable the per event logs
+    LOG_BACKGROUND = False  # write the log file from a background thread
+    EVENT_TRACE_FILE = None  # e.g. "event_trace.jsonl", one JSON line per event
+    # e.g. "event_trace.bin", compact binary trace for replay (eventtrace.py)
+    EVENT_TRACE_BINARY = None
+
+    # instrumentation
+    # e.g. "samples.csv", queue depth, mempools, orphans, tips, ... over time
+    SAMPLE_FILE = None
+    SAMPLE_SIM_INTERVAL = AVG_BLOCK_MINING_TIME  # ms of simulation time, or None
+    SAMPLE_WALL_INTERVAL = None  # s of wall time, or None
+    # e.g. "metrics.jsonl", the summary.json rows (MPU ratios, stale blocks,
+    # reorgs) of all peers every METRICS_SIM_INTERVAL ms, see metrics.py
+    METRICS_FILE = None
+    METRICS_SIM_INTERVAL = 10 * AVG_BLOCK_MINING_TIME
+    # end the run early once the selfish MPU ratios moved by at most this
+    # over the last METRICS_STOP_WINDOW lines, None runs to MAX_NUM_BLOCKS
+    METRICS_STOP_TOLERANCE = None
+    METRICS_STOP_WINDOW = 5
+    PROFILE_EVENTS = False  # per event type / handler timing, see profiler.py
+    PROFILE_RATE_INTERVAL = 1.0  # wall seconds between events/sec samples
+    # tracemalloc bytes per simulator module (memprofile.py), memory_report.txt
+    MEMORY_PROFILE = False
+    MEMORY_SNAPSHOT_INTERVAL = 100000  # executed events, also on every checkpoint
+    MEMORY_TOP_N = 10  # allocation sites listed per snapshot
+    # exit with status 1 when the end snapshot is above these, None to skip
+    MEMORY_BUDGET_PER_BLOCK = None  # bytes
+    MEMORY_BUDGET_PER_TXN = None  # bytes
+
     def __dict__(self):
         return {
             "TEST_CASE_NAME": self.TEST_CASE_NAME,
@@ -34,6 +103,7 @@ class Config:
             "Z2": self.Z2,
             "AVG_TXN_INTERVAL_TIME": self.AVG_TXN_INTERVAL_TIME,
             "SAVE_RESULTS": self.SAVE_RESULTS,
+            "VISUALIZE": self.VISUALIZE,
             "Z0": self.Z0,
             "NUMBER_OF_TRANSACTIONS_PER_PEER": self.NUMBER_OF_TRANSACTIONS_PER_PEER,
             "INITIAL_COINS": self.INITIAL_COINS,
@@ -44,6 +114,37 @@ class Config:
             "AVG_BLOCK_MINING_TIME": self.AVG_BLOCK_MINING_TIME,
             "MAX_NUM_BLOCKS": self.MAX_NUM_BLOCKS,
             "NUMBER_OF_TRANSACTIONS": self.NUMBER_OF_TRANSACTIONS,
+            "SEED": self.SEED,
+            "MAX_SIM_TIME": self.MAX_SIM_TIME,
+            "PROPAGATION_FILE": self.PROPAGATION_FILE,
+            "HONEST_POOLS": self.HONEST_POOLS,
+            "TXN_RELAY_WINDOW": self.TXN_RELAY_WINDOW,
+            "ORPHAN_POOL_SIZE": self.ORPHAN_POOL_SIZE,
+            "ORPHAN_TIMEOUT": self.ORPHAN_TIMEOUT,
+            "FINALITY_DEPTH": self.FINALITY_DEPTH,
+            "FINALITY_SPILL_FILE": self.FINALITY_SPILL_FILE,
+            "GLOBAL_MINING_SCHEDULER": self.GLOBAL_MINING_SCHEDULER,
+            "PARALLEL_WORKERS": self.PARALLEL_WORKERS,
+            "CHECKPOINT_FILE": self.CHECKPOINT_FILE,
+            "CHECKPOINT_INTERVAL": self.CHECKPOINT_INTERVAL,
+            "LOG_LEVEL": self.LOG_LEVEL,
+            "LOG_BACKGROUND": self.LOG_BACKGROUND,
+            "EVENT_TRACE_FILE": self.EVENT_TRACE_FILE,
+            "EVENT_TRACE_BINARY": self.EVENT_TRACE_BINARY,
+            "SAMPLE_FILE": self.SAMPLE_FILE,
+            "SAMPLE_SIM_INTERVAL": self.SAMPLE_SIM_INTERVAL,
+            "SAMPLE_WALL_INTERVAL": self.SAMPLE_WALL_INTERVAL,
+            "METRICS_FILE": self.METRICS_FILE,
+            "METRICS_SIM_INTERVAL": self.METRICS_SIM_INTERVAL,
+            "METRICS_STOP_TOLERANCE": self.METRICS_STOP_TOLERANCE,
+            "METRICS_STOP_WINDOW": self.METRICS_STOP_WINDOW,
+            "PROFILE_EVENTS": self.PROFILE_EVENTS,
+            "PROFILE_RATE_INTERVAL": self.PROFILE_RATE_INTERVAL,
+            "MEMORY_PROFILE": self.MEMORY_PROFILE,
+            "MEMORY_SNAPSHOT_INTERVAL": self.MEMORY_SNAPSHOT_INTERVAL,
+            "MEMORY_TOP_N": self.MEMORY_TOP_N,
+            "MEMORY_BUDGET_PER_BLOCK": self.MEMORY_BUDGET_PER_BLOCK,
+            "MEMORY_BUDGET_PER_TXN": self.MEMORY_BUDGET_PER_TXN,
         }
 
 
@@ -0,0 +1,319 @@
+"""
+Compact binary event trace and replay.
+
+TraceRecorder appends one fixed size record per executed event to <path>:
+time, type, peer, link and message id, all integer coded (RECORD_DTYPE).
+Two more record types describe chain state changes, BLOCK_ACCEPTED when a
+peer adds a block to its tree and BLOCK_REMOVED when a selfish peer drops an
+abandoned private block. Blocks are described once, in order of first
+acceptance (the block registry order), in <path>.blocks (BLOCK_DTYPE).
+A batched TXN_RECEIVE (TXN_RELAY_WINDOW) is written as one record per
+transaction of the batch, all with the time, peer and link of the event.
+<path>.json holds the code tables (types, peers) and the run config.
+
+Both files are raw NumPy arrays, TraceReader memory maps them. Replaying
+rebuilds every peer's block tree and longest chain from the acceptance
+records, without sampling delays or validating blocks again.
+
+Usage: python eventtrace.py event_trace.bin [--counts]
+"""
+
+import json
+import argparse
+from typing import Any
+
+import numpy as np
+
+from DiscreteEventSim import EventType
+
+RECORD_DTYPE = np.dtype(
+    [
+        ("time", "<f8"),
+        ("type", "u1"),
+        ("peer", "<i4"),  # peer executing the event, -1 if none
+        ("link", "<i4"),  # sending peer of a received message, -1 otherwise
+        ("msg", "<i8"),  # block or txn id, -1 if the event carries neither
+    ]
+)
+BLOCK_DTYPE = np.dtype(
+    [
+        ("block_id", "<i8"),
+        ("parent", "<i4"),  # row of the parent block, -1 for the genesis block
+        ("miner", "<i4"),  # peer code, -1 for the genesis block
+        ("timestamp", "<f8"),
+        ("num_txns", "<i4"),
+        ("is_private", "u1"),
+    ]
+)
+
+RECORD_TYPES = [event_type.name for event_type in EventType] + ["BLOCK_REMOVED"]
+BLOCK_ACCEPTED = RECORD_TYPES.index(EventType.BLOCK_ACCEPTED.name)
+BLOCK_REMOVED = RECORD_TYPES.index("BLOCK_REMOVED")
+
+CHUNK = 1 << 16  # records buffered before a write
+
+
+class TraceRecorder:
+    """
+    Append only binary trace of a run, see the module docstring.
+    """
+
+    def __init__(self, path: str, peers: list, registry, config: dict = None):
+        self.path = path
+        self.registry = registry
+        self._peers = peers
+        self._codes: dict[int, int] = {id(peer): code for code, peer in enumerate(peers)}
+        self._type_codes = {
+            event_type: code for code, event_type in enumerate(EventType)
+        }
+        self._config = config or {}
+        self._file = open(path, "wb")
+        self._blocks_file = open(path + ".blocks", "wb")
+        self._buffer = np.zeros(CHUNK, dtype=RECORD_DTYPE)
+        self._buffered = 0
+        self.num_records = 0
+        self.num_blocks = 0
+
+    def _peer_code(self, obj: Any) -> int:
+        code = self._codes.get(id(obj))
+        if code is None:
+            # block chains act for their peer
+            code = self._codes.get(id(getattr(obj, "_peer_id", None)), -1)
+        return code
+
+    def _append(self, time: float, type_code: int, peer: int, link: int, msg: int):
+        self._buffer[self._buffered] = (time, type_code, peer, link, msg)
+        self._buffered += 1
+        if self._buffered == CHUNK:
+            self.flush()
+
+    def record_event(self, event):
+        """
+        an executed event, called before its action runs
+        """
+        action = event.action
+        peer = self._peer_code(getattr(action, "__self__", None))
+        type_code = self._type_codes[event.type]
+        link, msg = -1, -1
+        if event.payload:
+            message = event.payload[0]
+            if event.type in (EventType.BLOCK_RECEIVE, EventType.TXN_RECEIVE):
+                link = self._peer_code(event.payload[1])
+            if isinstance(message, tuple):
+                # a batch of txns (TXN_RELAY_WINDOW), one record per txn
+                for txn in message:
+                    self._append(event.actionable_at, type_code, peer, link, txn.txn_id)
+                return
+            msg = getattr(message, "block_id", getattr(message, "txn_id", -1))
+        self._append(event.actionable_at, type_code, peer, link, msg)
+
+    def record_accepted(self, peer, block, time: float):
+        self._describe_blocks(block.index)
+        self._append(time, BLOCK_ACCEPTED, self._peer_code(peer), -1, block.block_id)
+
+    def record_removed(self, peer, block, time: float):
+        self._append(time, BLOCK_REMOVED, self._peer_code(peer), -1, block.block_id)
+
+    def _describe_blocks(self, upto: int):
+        """
+        append the block table rows of registry entries up to upto
+        """
+        if upto < self.num_blocks:
+            return
+        # rows are described as they are accepted, before the registry
+        # drops them (BlockRegistry.track_final)
+        base = self.registry.base
+        blocks = self.registry.blocks[self.num_blocks - base : upto + 1 - base]
+        rows = np.zeros(len(blocks), dtype=BLOCK_DTYPE)
+        for row, block in zip(rows, blocks):
+            parent = block.prev_block
+            row["block_id"] = block.block_id
+            row["parent"] = parent.index if parent is not None else -1
+            row["miner"] = self._peer_code(block.miner)
+            row["timestamp"] = block.timestamp
+            row["num_txns"] = len(block.transactions)
+            row["is_private"] = block.is_private
+        rows.tofile(self._blocks_file)
+        self.num_blocks += len(blocks)
+
+    def flush(self):
+        self._buffer[: self._buffered].tofile(self._file)
+        self.num_records += self._buffered
+        self._buffered = 0
+
+    def close(self):
+        if self._file.closed:
+            return
+        self._describe_blocks(len(self.registry) - 1)
+        self.flush()
+        self._file.close()
+        self._blocks_file.close()
+        header = {
+            "record_types": RECORD_TYPES,
+            "peers": [
+                {"name": repr(peer), "id": peer.id, "type": peer.type}
+                for peer in self._peers
+            ],
+            "num_records": self.num_records,
+            "num_blocks": self.num_blocks,
+            "config": self._config,
+        }
+        with open(self.path + ".json", "w") as f:
+            json.dump(header, f, indent=4, default=str)
+
+
+def _load(path: str, dtype: np.dtype) -> np.ndarray:
+    try:
+        return np.memmap(path, dtype=dtype, mode="r")
+    except ValueError:  # empty file
+        return np.zeros(0, dtype=dtype)
+
+
+class TraceReader:
+    """
+    Memory mapped view of a trace written by TraceRecorder.
+    """
+
+    def __init__(self, path: str):
+        with open(path + ".json") as f:
+            self.header: dict = json.load(f)
+        self.records = _load(path, RECORD_DTYPE)
+        self.blocks = _load(path + ".blocks", BLOCK_DTYPE)
+        self.record_types: list[str] = self.header["record_types"]
+        self.peers: list[dict] = self.header["peers"]
+
+    def type_code(self, name: str) -> int:
+        return self.record_types.index(name)
+
+    def of_type(self, name: str) -> np.ndarray:
+        return self.records[self.records["type"] == self.type_code(name)]
+
+    def event_counts(self) -> dict[str, int]:
+        counts = np.bincount(self.records["type"], minlength=len(self.record_types))
+        return {name: int(count) for name, count in zip(self.record_types, counts)}
+
+    def heights(self) -> np.ndarray:
+        """
+        height per block row, the genesis block has height 1
+        """
+        parents = self.blocks["parent"]
+        heights = np.ones(len(parents), dtype=np.int64)
+        for row in range(len(parents)):
+            # parents are described before their children
+            if parents[row] >= 0:
+                heights[row] = heights[parents[row]] + 1
+        return heights
+
+
+class ReplayedChain:
+    """
+    One peer's block tree rebuilt from its acceptance records, choosing the
+    longest chain leaf like BlockChainHonest / BlockChainSecret do: the first
+    block of another miner to reach a new height (own blocks are added
+    without moving it), and for selfish peers the own private branch unless
+    the public one is strictly longer.
+    """
+
+    def __init__(self, code: int, peer: dict, genesis: int):
+        self.code = code
+        self.peer = peer
+        self.is_selfish = peer["type"] == "SelfishPeer"
+        self.arrival: dict[int, float] = {genesis: 0.0}  # block row -> time
+        self.public_leaf = genesis
+        self.secret_leaf = None
+        self.owned_total = 0
+
+    def accept(self, row: int, time: float, miner: int, heights: np.ndarray):
+        self.arrival[row] = time
+        if miner == self.code:
+            self.owned_total += 1
+            if self.is_selfish:
+                self.secret_leaf = row
+            return
+        if heights[row] > heights[self.public_leaf]:
+            self.public_leaf = row
+
+    def remove(self, row: int, miner: int):
+        del self.arrival[row]
+        self.owned_total -= miner == self.code
+        self.secret_leaf = self.public_leaf
+
+    def leaf(self, heights: np.ndarray) -> int:
+        if self.secret_leaf is None or (
+            heights[self.public_leaf] > heights[self.secret_leaf]
+        ):
+            return self.public_leaf
+        return self.secret_leaf
+
+
+def replay_chains(trace: TraceReader) -> list[ReplayedChain]:
+    heights = trace.heights()
+    rows = {int(block_id): row for row, block_id in enumerate(trace.blocks["block_id"])}
+    miners = trace.blocks["miner"]
+    chains = [ReplayedChain(code, peer, 0) for code, peer in enumerate(trace.peers)]
+    changes = trace.records[
+        np.isin(trace.records["type"], (BLOCK_ACCEPTED, BLOCK_REMOVED))
+    ]
+    for time, type_code, peer, msg in zip(
+        changes["time"].tolist(),
+        changes["type"].tolist(),
+        changes["peer"].tolist(),
+        changes["msg"].tolist(),
+    ):
+        row = rows[msg]
+        if type_code == BLOCK_ACCEPTED:
+            chains[peer].accept(row, time, miners[row], heights)
+        else:
+            chains[peer].remove(row, miners[row])
+    return chains
+
+
+def mpu_ratios(trace: TraceReader) -> list[dict]:
+    """
+    the MPU fields of simulation.calculate_mpu_ratios, from the trace alone
+    """
+    heights = trace.heights()
+    parents = trace.blocks["parent"]
+    miners = trace.blocks["miner"]
+    ratios = []
+    for chain in replay_chains(trace):
+        row = chain.leaf(heights)
+        public_chain_by_all = int(heights[row])
+        public_chain_by_peer = 0
+        while row >= 0:
+            public_chain_by_peer += miners[row] == chain.code
+            row = parents[row]
+        mined_by_peer = chain.owned_total
+        mined_by_all = len(chain.arrival)
+        ratios.append(
+            {
+                "peer": chain.peer["name"],
+                "peer_id": chain.peer["id"],
+                "type": chain.peer["type"],
+                "mpu_adv": public_chain_by_peer / mined_by_peer if mined_by_peer else 0,
+                "mpu_overall": public_chain_by_all / mined_by_all,
+                "num_blocks_public_chain_by_peer": int(public_chain_by_peer),
+                "num_blocks_public_chain_by_all": public_chain_by_all,
+                "num_blocks_mined_by_peer": mined_by_peer,
+                "num_blocks_mined_by_all": mined_by_all,
+            }
+        )
+    return ratios
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("path", help="trace file (EVENT_TRACE_BINARY)")
+    parser.add_argument(
+        "--counts", action="store_true", help="executed records per type instead"
+    )
+    args = parser.parse_args()
+    trace = TraceReader(args.path)
+    if args.counts:
+        print(json.dumps(trace.event_counts(), indent=4))
+    else:
+        print(json.dumps(mpu_ratios(trace), indent=4))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+"""
+Hybrid fidelity: the honest miners as a few aggregate pool nodes.
+
+A full run with CONFIG.PROPAGATION_FILE set fits the block propagation
+delays of its network (see fit_propagation): for every block, the time from
+its miner publishing it to every other peer accepting it, grouped by the
+class of the miner and of the receiver ("honest", "S01", "S02").
+
+With CONFIG.HONEST_POOLS set, create_hybrid_network builds the two selfish
+peers and that many HonestPeer pools sharing the honest hashing power, all
+connected to each other. A block sent over a link takes a delay drawn from
+the fitted delays of its classes instead of one hop of the link model, so
+races between the selfish peers and the honest majority keep the timing of
+the full network; transactions still use the link model.
+"""
+
+import json
+import math
+import logging
+from itertools import combinations
+
+from Block import Block
+from Link import Link, OneWayLINK
+from Peer import HonestPeer, SelfishPeer, Peer
+from DiscreteEventSim import simulation
+from config import CONFIG
+
+logger = logging.getLogger(__name__)
+
+
+def peer_class(peer: Peer) -> str:
+    return str(peer.id) if peer.type == "SelfishPeer" else "honest"
+
+
+def fit_propagation(peers: list[Peer]) -> dict[str, list[float]]:
+    """
+    "<miner class>-><receiver class>" -> delays (ms) from publishing to
+    acceptance, over all blocks of the run but the genesis block (with
+    finality, the ones peers still know and the registry kept). Call it
+    before reconcile_chains: blocks it releases or delivers did not cross
+    the network.
+    """
+    registry = simulation.block_registry
+    views = [peer.block_chain._blocks for peer in peers]
+    arrival = registry.arrival_matrix(views)
+    classes = [peer_class(peer) for peer in peers]
+    delays: dict[str, list[float]] = {}
+    for index, released in registry.release_time.items():
+        miner = registry.block(index).miner
+        if not isinstance(miner, Peer):  # genesis block
+            continue
+        source = peer_class(miner)
+        for row, peer in enumerate(peers):
+            arrived = float(arrival[row, index - registry.base])
+            if peer is miner or math.isnan(arrived):
+                continue
+            delay = arrived - released
+            if delay < 0:
+                raise ValueError(
+                    f"{registry.block(index)} reached {peer} {-delay} ms before "
+                    "its release, fit before reconcile_chains"
+                )
+            delays.setdefault(f"{source}->{classes[row]}", []).append(delay)
+    return delays
+
+
+def save_propagation(path: str, peers: list[Peer]):
+    delays = fit_propagation(peers)
+    with open(path, "w") as f:
+        json.dump({"num_peers": len(peers), "delays": delays}, f)
+    logger.info(
+        "propagation delays written to %s: %s",
+        path,
+        {key: len(samples) for key, samples in delays.items()},
+    )
+
+
+def load_propagation(path: str) -> dict[str, list[float]]:
+    with open(path) as f:
+        return json.load(f)["delays"]
+
+
+class FittedOneWayLINK(OneWayLINK):
+    """
+    one way link whose block delay is drawn from fitted propagation delays
+    """
+
+    def __init__(self, from_peer, to_peer, pij, cij, block_delays: list[float]):
+        super().__init__(from_peer, to_peer, pij, cij)
+        self.block_delays = block_delays
+
+    def _message_delay(self, message) -> float:
+        if isinstance(message, Block) and self.block_delays:
+            return self.rng.choice(self.block_delays)
+        return super()._message_delay(message)
+
+
+class FittedLink(Link):
+    def __init__(self, peer1: Peer, peer2: Peer, delays: dict[str, list[float]]):
+        super().__init__(peer1, peer2)
+        class1, class2 = peer_class(peer1), peer_class(peer2)
+        self.link1 = FittedOneWayLINK(
+            peer1, peer2, self.pij, self.cij, delays.get(f"{class1}->{class2}")
+        )
+        self.link2 = FittedOneWayLINK(
+            peer2, peer1, self.pij, self.cij, delays.get(f"{class2}->{class1}")
+        )
+
+
+def create_hybrid_network(pools: int, delays: dict[str, list[float]]) -> list[Peer]:
+    classes = ("honest", "S01", "S02")
+    missing = [
+        f"{source}->{receiver}"
+        for source in classes
+        for receiver in classes
+        if (source != receiver or source == "honest")
+        and not delays.get(f"{source}->{receiver}")
+    ]
+    if missing:
+        logger.warning("no fitted delays for %s, blocks use the link model", missing)
+    honest_hashing_power = (1 - CONFIG.Z1 - CONFIG.Z2) / pools
+    peers = [HonestPeer(id=i, cpu_power=honest_hashing_power) for i in range(pools)]
+    peers.append(SelfishPeer(id="S01", cpu_power=CONFIG.Z1))
+    peers.append(SelfishPeer(id="S02", cpu_power=CONFIG.Z2))
+
+    for peer in peers:
+        peer.init_blockchain(peers=peers)
+    for peer1, peer2 in combinations(peers, 2):
+        link = FittedLink(peer1, peer2, delays)
+        peer1.connect(peer=peer2, link=link)
+        peer2.connect(peer=peer1, link=link)
+    return peers
@@ -1,5 +1,10 @@
 import sys
+import json
+import atexit
 import logging
+import threading
+from queue import SimpleQueue
+from logging.handlers import QueueHandler, QueueListener
 
 
 # logging.basicConfig(level=logging.DEBUG,
@@ -8,15 +13,92 @@ import logging
 #                     format='%(asctime)s - %(levelname)s - %(funcName)s - %(message)s')
 # logger = logging.getLogger(__name__)
 
+LOG_FILE = "blockchain_simulation.log"
+LOG_FORMAT = "%(asctime)s - %(levelname)s - %(funcName)s - %(message)s"
 
-def init_logger():
-    logging.basicConfig(
-        # level=logging.DEBUG,
-        # stream=sys.stdout,
-        filename="blockchain_simulation.log",
-        filemode="w",
-        format="%(asctime)s - %(levelname)s - %(funcName)s - %(message)s",
-        datefmt="%H:%M:%S",
-    )
+_file_handler: logging.Handler = None
+_queue_handler: logging.Handler = None
+_listener: QueueListener = None
+
+
+def init_logger(level=logging.WARNING, background=False):
+    """
+    Log to LOG_FILE at the given level.
+    background: hand records to a writer thread instead of writing them
+    synchronously from the simulation loop.
+    """
+    global _file_handler, _queue_handler, _listener
+    _file_handler = logging.FileHandler(LOG_FILE, mode="w")
+    _file_handler.setFormatter(logging.Formatter(LOG_FORMAT, datefmt="%H:%M:%S"))
+
+    root = logging.getLogger()
+    root.setLevel(level)
+    if background:
+        log_queue = SimpleQueue()
+        _queue_handler = QueueHandler(log_queue)
+        _listener = QueueListener(log_queue, _file_handler)
+        _listener.start()
+        atexit.register(stop_background_logging)
+        root.addHandler(_queue_handler)
+    else:
+        root.addHandler(_file_handler)
     logger = logging.getLogger(__name__)
     return logger
+
+
+def stop_background_logging():
+    """
+    Drain the writer thread and log synchronously from now on,
+    so LOG_FILE is complete before it gets copied.
+    """
+    global _queue_handler, _listener
+    if _listener is None:
+        return
+    _listener.stop()
+    root = logging.getLogger()
+    root.removeHandler(_queue_handler)
+    root.addHandler(_file_handler)
+    _file_handler.flush()
+    _queue_handler = None
+    _listener = None
+
+
+class EventTraceSink:
+    """
+    Structured trace of executed events, one JSON object per line.
+    Records are built from plain values, serialisation and file IO happen
+    on a writer thread when background is set.
+    """
+
+    def __init__(self, path: str, background: bool = True):
+        self.path = path
+        self._file = open(path, "w")
+        self._queue: SimpleQueue = None
+        self._thread: threading.Thread = None
+        if background:
+            self._queue = SimpleQueue()
+            self._thread = threading.Thread(
+                target=self.__writer, name="event-trace-writer", daemon=True
+            )
+            self._thread.start()
+
+    def __writer(self):
+        while True:
+            record = self._queue.get()
+            if record is None:
+                break
+            self._file.write(json.dumps(record) + "\n")
+
+    def emit(self, record: dict):
+        if self._queue is not None:
+            self._queue.put(record)
+        else:
+            self._file.write(json.dumps(record) + "\n")
+
+    def close(self):
+        if self._file.closed:
+            return
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+        self._file.close()
@@ -0,0 +1,223 @@
+import os
+import ast
+import logging
+import resource
+import tracemalloc
+
+logger = logging.getLogger(__name__)
+
+SOURCE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# allocations charged to blocks / transactions in bytes_per(), by the module
+# or module.function of the innermost simulator frame. Transaction objects are
+# allocated in the frame calling Transaction(), the mempool grows in
+# add_transaction, and the relay dedup sets gain one entry per message on
+# every peer and link, so they count per txn too (most messages are txns).
+TXN_MODULES = {"Transaction"}
+TXN_FUNCTIONS = {
+    "Peer.__create_txn",
+    "BlockChainBase.add_transaction",
+    "Peer.__forward_msg_to_peers",
+    "Link.delivery",
+    "Link.__queue_txn",
+    "Link.send_txn_batch",
+}
+BLOCK_MODULES = {
+    "Block",
+    "BlockChainBase",
+    "BlockChainHonest",
+    "BlockChainSecret",
+    "registry",
+    "chainindex",
+    "orphans",
+}
+# the rest of Peer and Link: links, forwarding tables and RNGs, per peer
+NETWORK_MODULES = {"Peer", "Link"}
+
+
+class MemoryAccounting:
+    """
+    tracemalloc snapshots every interval executed events (as a run hook) and
+    at the end of the run. Every traced allocation is charged to the
+    innermost simulator module on its stack (DiscreteEventSim, Peer, Link,
+    BlockChainBase, ...), so a heapq push from DiscreteEventSim or a set add
+    from Peer count for those modules and not for the standard library.
+    Allocations without a simulator frame are reported as "other". The same
+    allocations are also summed into the block / txn / network buckets.
+    """
+
+    def __init__(self, interval: int, top_n: int = 10, frames: int = 8):
+        self.interval = interval
+        self.top_n = top_n
+        self.frames = frames
+        self.snapshots: list[dict] = []
+        self._events = 0
+        self._next_snapshot = interval
+        self._owners: dict[str, str] = {}  # filename -> module
+        self._buckets: dict[tuple[str, int], str] = {}  # (filename, line) -> bucket
+        self._functions: dict[str, list[tuple[int, int, str]]] = {}
+
+    def start(self):
+        tracemalloc.start(self.frames)
+
+    def stop(self):
+        tracemalloc.stop()
+
+    def __call__(self, event):
+        """
+        run hook, called before every event
+        """
+        self._events += 1
+        if self.interval and self._events >= self._next_snapshot:
+            self._next_snapshot += self.interval
+            self.snapshot(f"event {self._events}")
+
+    def _owner(self, filename: str) -> str:
+        owner = self._owners.get(filename)
+        if owner is None:
+            directory, name = os.path.split(filename)
+            if directory == SOURCE_DIR and name.endswith(".py"):
+                owner = name[:-3]
+            else:
+                owner = ""
+            self._owners[filename] = owner
+        return owner
+
+    def _function(self, filename: str, lineno: int) -> str:
+        """
+        name of the innermost function of filename around lineno, "" outside
+        """
+        functions = self._functions.get(filename)
+        if functions is None:
+            with open(filename) as f:
+                tree = ast.parse(f.read())
+            functions = [
+                (node.lineno, node.end_lineno, node.name)
+                for node in ast.walk(tree)
+                if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef))
+            ]
+            functions.sort()  # outer functions before the ones nested in them
+            self._functions[filename] = functions
+        name = ""
+        for start, end, function in functions:
+            if start > lineno:
+                break
+            if lineno <= end:
+                name = function
+        return name
+
+    def _bucket(self, module: str, filename: str, lineno: int) -> str:
+        key = (filename, lineno)
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            function = f"{module}.{self._function(filename, lineno)}"
+            if module in TXN_MODULES or function in TXN_FUNCTIONS:
+                bucket = "txn"
+            elif module in BLOCK_MODULES:
+                bucket = "block"
+            elif module in NETWORK_MODULES:
+                bucket = "network"
+            else:
+                bucket = "other"
+            self._buckets[key] = bucket
+        return bucket
+
+    def snapshot(self, label: str) -> dict:
+        snapshot = tracemalloc.take_snapshot().filter_traces(
+            [tracemalloc.Filter(False, tracemalloc.__file__)]
+        )
+        by_module: dict[str, int] = {}
+        by_bucket = {"block": 0, "txn": 0, "network": 0, "other": 0}
+        for trace in snapshot.traces:
+            module = bucket = "other"
+            for frame in reversed(trace.traceback):  # innermost frame first
+                owner = self._owner(frame.filename)
+                if owner:
+                    module = owner
+                    bucket = self._bucket(owner, frame.filename, frame.lineno)
+                    break
+            by_module[module] = by_module.get(module, 0) + trace.size
+            by_bucket[bucket] += trace.size
+        current, peak = tracemalloc.get_traced_memory()
+        record = {
+            "label": label,
+            "traced": current,
+            "peak_traced": peak,
+            # ru_maxrss is in KB on Linux
+            "peak_rss": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+            "by_module": dict(sorted(by_module.items(), key=lambda item: -item[1])),
+            "by_bucket": by_bucket,
+            "top": [
+                (str(stat.traceback), stat.size, stat.count)
+                for stat in snapshot.statistics("lineno")[: self.top_n]
+            ],
+        }
+        self.snapshots.append(record)
+        logger.info(
+            "memory %s: %.1f MB traced, peak rss %.1f MB",
+            label,
+            current / 2**20,
+            record["peak_rss"] / 2**20,
+        )
+        return record
+
+    def bytes_per(self, num_blocks: int, num_txns: int) -> tuple[float, float]:
+        """
+        bytes of the block / txn buckets in the last snapshot, divided by the
+        number of blocks / transactions
+        """
+        by_bucket = self.snapshots[-1]["by_bucket"]
+        return (
+            by_bucket["block"] / max(num_blocks, 1),
+            by_bucket["txn"] / max(num_txns, 1),
+        )
+
+    def check_budget(
+        self,
+        num_blocks: int,
+        num_txns: int,
+        per_block: float = None,
+        per_txn: float = None,
+    ) -> list[str]:
+        """
+        budget violations of the last snapshot, empty when within budget
+        """
+        block_bytes, txn_bytes = self.bytes_per(num_blocks, num_txns)
+        problems = []
+        if per_block is not None and block_bytes > per_block:
+            problems.append(f"{block_bytes:.0f} bytes per block > {per_block}")
+        if per_txn is not None and txn_bytes > per_txn:
+            problems.append(f"{txn_bytes:.0f} bytes per txn > {per_txn}")
+        return problems
+
+    def report(self, num_blocks: int = None, num_txns: int = None) -> str:
+        lines = []
+        for record in self.snapshots:
+            lines.append(
+                f"== {record['label']}: {record['traced'] / 2**20:.2f} MB traced, "
+                f"peak {record['peak_traced'] / 2**20:.2f} MB traced, "
+                f"peak rss {record['peak_rss'] / 2**20:.1f} MB"
+            )
+            for module, size in record["by_module"].items():
+                lines.append(f"  {module:<20} {size / 2**10:12.1f} KB")
+            lines.append(
+                "  buckets: "
+                + ", ".join(
+                    f"{bucket} {size / 2**10:.1f} KB"
+                    for bucket, size in record["by_bucket"].items()
+                )
+            )
+            lines.append(f"  top {self.top_n} allocation sites:")
+            for site, size, count in record["top"]:
+                lines.append(f"    {size / 2**10:10.1f} KB {count:8} blocks  {site}")
+        if self.snapshots and num_blocks is not None:
+            block_bytes, txn_bytes = self.bytes_per(num_blocks, num_txns)
+            lines.append(
+                f"{block_bytes:.0f} bytes per block ({num_blocks} blocks), "
+                f"{txn_bytes:.0f} bytes per txn ({num_txns} txns)"
+            )
+        return "\n".join(lines)
+
+    def write_report(self, path: str, num_blocks: int = None, num_txns: int = None):
+        with open(path, "w") as f:
+            f.write(self.report(num_blocks, num_txns) + "\n")
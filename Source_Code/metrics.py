@@ -0,0 +1,167 @@
+import json
+import logging
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+# mpu_ratio fields that depend on the order blocks arrive in at the end of
+# the run: one merge in serial runs, a hop by hop drain in parallel ones
+REORG_FIELDS = ("num_reorgs", "max_reorg_depth", "reorg_depth_total")
+
+
+class ChainMetrics:
+    """
+    Fork metrics of one peer, kept up to date as its canonical tip (the
+    longest chain leaf) moves. A move to a block that does not extend the
+    previous tip is a reorg, its depth is the number of blocks abandoned.
+    """
+
+    __slots__ = ("tip", "tip_changes", "reorgs", "reorg_depth_total", "reorg_depths")
+
+    def __init__(self, tip):
+        self.tip = tip
+        self.tip_changes = 0
+        self.reorgs = 0
+        self.reorg_depth_total = 0
+        self.reorg_depths: dict[int, int] = {}  # depth -> reorgs
+
+    def observe(self, index, tip):
+        """
+        tip is the current canonical tip, index the peer's ChainIndex
+        """
+        if tip is self.tip:
+            return
+        depth = index.reorg_depth(self.tip, tip)
+        self.tip = tip
+        self.tip_changes += 1
+        if depth:
+            self.reorgs += 1
+            self.reorg_depth_total += depth
+            self.reorg_depths[depth] = self.reorg_depths.get(depth, 0) + 1
+
+    @property
+    def max_reorg_depth(self) -> int:
+        return max(self.reorg_depths, default=0)
+
+
+def mpu_ratio(peer) -> dict:
+    """
+    MPU ratios and fork metrics of peer from its live counters, O(1) and
+    valid at any point of the run
+    """
+    block_chain = peer.block_chain
+    (
+        num_blocks_public_chain_by_all,
+        num_blocks_public_chain_by_peer,
+    ) = block_chain.get_longest_chain_stats()
+    num_blocks_mined_by_peer = block_chain.get_num_blocks_mined()
+    num_blocks_mined_by_all = block_chain.get_num_blocks()
+    fork = block_chain.get_chain_metrics()
+
+    if num_blocks_mined_by_peer == 0:
+        mpu_adv = 0
+    else:
+        mpu_adv = num_blocks_public_chain_by_peer / num_blocks_mined_by_peer
+    mpu_overall = num_blocks_public_chain_by_all / num_blocks_mined_by_all
+
+    return {
+        "peer": peer.__repr__(),
+        "peer_id": peer.id,
+        "type": peer.type,
+        "mpu_adv": mpu_adv,
+        "mpu_overall": mpu_overall,
+        "num_blocks_public_chain_by_peer": num_blocks_public_chain_by_peer,
+        "num_blocks_public_chain_by_all": num_blocks_public_chain_by_all,
+        "num_blocks_mined_by_peer": num_blocks_mined_by_peer,
+        "num_blocks_mined_by_all": num_blocks_mined_by_all,
+        "num_stale_blocks": num_blocks_mined_by_all - num_blocks_public_chain_by_all,
+        "num_stale_blocks_by_peer": num_blocks_mined_by_peer
+        - num_blocks_public_chain_by_peer,
+        "num_reorgs": fork.reorgs,
+        "max_reorg_depth": fork.max_reorg_depth,
+        "reorg_depth_total": fork.reorg_depth_total,
+    }
+
+
+class MetricsStream:
+    """
+    Run hook appending the MPU ratios of all peers as one JSON line
+    {"sim_time", "events", "mpu_ratios"} before the first event at or after
+    every sim_interval ms, and once more on close. A sweep can follow a run
+    from this file without waiting for the export.
+
+    With stop_tolerance set the run ends early (like at MAX_NUM_BLOCKS) once
+    mpu_adv and mpu_overall of every selfish peer moved by at most
+    stop_tolerance over the last stop_window lines.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        simulation,
+        peers: list,
+        sim_interval: float,
+        stop_tolerance: float = None,
+        stop_window: int = 5,
+    ):
+        self.path = path
+        self.simulation = simulation
+        self.peers = peers
+        self.sim_interval = sim_interval
+        self.stop_tolerance = stop_tolerance
+        self.lines = 0
+        self._recent: deque[list[float]] = deque(maxlen=stop_window + 1)
+        self._file = open(path, "w")
+        self._next_sim_time = simulation.clock + sim_interval
+
+    def __call__(self, event):
+        """
+        run hook, called before every event
+        """
+        if self.simulation.clock >= self._next_sim_time:
+            ratios = self.write()
+            while self._next_sim_time <= self.simulation.clock:
+                self._next_sim_time += self.sim_interval
+            if self.stop_tolerance is not None and not self.simulation.stop_sim:
+                self._stop_if_stable(ratios)
+
+    def write(self) -> list[dict]:
+        ratios = [mpu_ratio(peer) for peer in self.peers]
+        record = {
+            "sim_time": self.simulation.clock,
+            "events": self.simulation.events_executed,
+            "mpu_ratios": ratios,
+        }
+        self._file.write(json.dumps(record) + "\n")
+        self._file.flush()
+        self.lines += 1
+        return ratios
+
+    def _stop_if_stable(self, ratios: list[dict]):
+        self._recent.append(
+            [
+                value
+                for ratio in ratios
+                if ratio["type"] == "SelfishPeer"
+                for value in (ratio["mpu_adv"], ratio["mpu_overall"])
+            ]
+        )
+        if len(self._recent) < self._recent.maxlen:
+            return
+        oldest = self._recent[0]
+        for values in self._recent:
+            if any(
+                abs(value - first) > self.stop_tolerance
+                for value, first in zip(values, oldest)
+            ):
+                return
+        logger.info("MPU ratios stable, stopping at %s", self.simulation.clock)
+        self.simulation.stop_sim = True
+        self.simulation.end_run = True
+
+    def close(self):
+        if self._file.closed:
+            return
+        self.write()
+        self._file.close()
+        logger.info("%s metric lines written to %s", self.lines, self.path)
@@ -0,0 +1,98 @@
+import logging
+from typing import Any
+
+from Block import Block
+from DiscreteEventSim import simulation, Event, EventType
+from utils import spawn_rng
+
+logger = logging.getLogger(__name__)
+
+
+class MiningScheduler:
+    """
+    Samples the next mined block for the whole network instead of one
+    BLOCK_MINE_FINISH event per miner.
+
+    Every miner works on one attempt at a time, mining at rate
+    cpu_power / avg_interval_time. Attempts are grouped by the tip they
+    extend. The time to the next block is exponential in the summed rate
+    of all attempts; the tip group is then drawn by its summed rate and the
+    winner inside the group by its own rate. Since exponentials are
+    memoryless this has the same statistics as the per miner events: a tip
+    change only moves an attempt between groups, and the single pending
+    event is redrawn only when the total rate changes (a miner starts or
+    stops mining).
+    """
+
+    def __init__(self):
+        self.attempts: dict[Any, Block] = {}  # block chain -> block being mined
+        self.rates: dict[Any, float] = {}
+        self.groups: dict[Block, dict[Any, float]] = {}  # tip -> chain -> rate
+        self.group_rates: dict[Block, float] = {}
+        self.total_rate = 0.0
+        self.rng = spawn_rng()
+        self._next_block_event: Event = None
+
+    def start(self, chain, block: Block):
+        """
+        chain mines block from now on, replacing its previous attempt
+        """
+        was_mining = chain in self.attempts
+        if was_mining:
+            self._remove(chain)
+        rate = chain.cpu_power / chain.avg_interval_time
+        tip = block.prev_block
+        self.attempts[chain] = block
+        self.rates[chain] = rate
+        self.groups.setdefault(tip, {})[chain] = rate
+        self.group_rates[tip] = self.group_rates.get(tip, 0.0) + rate
+        self.total_rate = sum(self.group_rates.values())
+        if not was_mining:
+            self._reschedule()
+
+    def cancel(self, chain):
+        if chain in self.attempts:
+            self._remove(chain)
+            self._reschedule()
+
+    def _remove(self, chain) -> Block:
+        block = self.attempts.pop(chain)
+        rate = self.rates.pop(chain)
+        tip = block.prev_block
+        group = self.groups[tip]
+        del group[chain]
+        if group:
+            self.group_rates[tip] -= rate
+        else:
+            del self.groups[tip]
+            del self.group_rates[tip]
+        self.total_rate = sum(self.group_rates.values())
+        return block
+
+    def _reschedule(self):
+        if self._next_block_event:
+            self._next_block_event.cancel()
+            self._next_block_event = None
+        if not self.attempts:
+            return
+        self._next_block_event = Event(
+            EventType.BLOCK_MINE_FINISH,
+            simulation.clock,
+            self.rng.expovariate(self.total_rate),
+            self._block_found,
+            (),
+            f"next block of {len(self.attempts)} miners on {len(self.groups)} tips",
+        )
+        simulation.enqueue(self._next_block_event)
+
+    def _block_found(self):
+        self._next_block_event = None
+        tips = list(self.group_rates)
+        tip = self.rng.choices(tips, weights=[self.group_rates[t] for t in tips])[0]
+        group = self.groups[tip]
+        chains = list(group)
+        chain = self.rng.choices(chains, weights=[group[c] for c in chains])[0]
+        block = self._remove(chain)
+        self._reschedule()
+        logger.debug("%s won the race on %s", chain.peer_id, tip)
+        chain._mine_block_end(block)
@@ -0,0 +1,253 @@
+"""
+Network free Monte Carlo engine for the double selfish mining state machine.
+
+Every step one block is found, by S01 with probability Z1, by S02 with Z2 and by
+the honest pool otherwise. Each selfish miner follows the transitions of
+PrivateBlockChain._update_lead (states 0, 0', 1, 2, >2) against the public
+chain; network propagation is reduced to gamma, the share of honest mining
+power that builds on the selfish block during a 0' race.
+All replicates advance together as NumPy arrays, chains are kept as block
+counts per miner rather than block lists: the public tip and the fork point
+of each private branch store how many blocks of every miner lie below them.
+
+Usage: python montecarlo.py --z1 0.3 --z2 0.2 --blocks 1000 --replicates 10000
+"""
+
+import json
+import argparse
+
+import numpy as np
+
+from config import CONFIG
+
+S01, S02, HONEST = 0, 1, 2
+MINERS = [
+    ("SelfishPeer(id=S01)", "S01", "SelfishPeer"),
+    ("SelfishPeer(id=S02)", "S02", "SelfishPeer"),
+    ("HonestPool", "honest", "HonestPeer"),
+]
+
+TIE = 0.5  # state 0'
+
+
+class DoubleSelfishMining:
+    def __init__(self, replicates: int, z1: float, z2: float, gamma: float, rng):
+        self.replicates = replicates
+        self.z1 = z1
+        self.z2 = z2
+        self.gamma = gamma
+        self.rng = rng
+
+        # public chain: height and blocks per miner below the tip
+        self.height = np.zeros(replicates, dtype=np.int64)
+        self.counts = np.zeros((3, replicates), dtype=np.int64)
+        self.mined = np.zeros((3, replicates), dtype=np.int64)
+
+        # private branch of each selfish miner
+        self.base = np.zeros((2, replicates), dtype=np.int64)
+        self.base_counts = np.zeros((2, 3, replicates), dtype=np.int64)
+        self.private = np.zeros((2, replicates), dtype=np.int64)
+        self.hidden = np.zeros((2, replicates), dtype=np.int64)
+        self.state = np.zeros((2, replicates), dtype=np.float64)
+
+    def lead(self, i: int):
+        return self.base[i] + self.private[i] - self.height
+
+    def _rebase(self, i: int, mask):
+        """
+        mine on the public tip (state 0)
+        """
+        self.base[i][mask] = self.height[mask]
+        self.base_counts[i][:, mask] = self.counts[:, mask]
+        self.private[i][mask] = 0
+        self.hidden[i][mask] = 0
+        self.state[i][mask] = 0
+
+    def _adopt(self, i: int, mask):
+        """
+        the public chain switches to the private branch of i
+        """
+        self.height[mask] = self.base[i][mask] + self.private[i][mask]
+        self.counts[:, mask] = self.base_counts[i][:, mask]
+        self.counts[i][mask] += self.private[i][mask]
+
+    def own_block(self, i: int, mask):
+        """
+        selfish miner i found a block, returns where the public chain changed
+        """
+        self.mined[i][mask] += 1
+        self.private[i][mask] += 1
+        self.hidden[i][mask] += 1
+        state = self.state[i]
+
+        won_race = mask & (state == TIE)
+        self.hidden[i][won_race] = 0
+        self._adopt(i, won_race)
+        self._rebase(i, won_race)
+
+        start = mask & (state == 0) & ~won_race
+        state[start] = 1
+        ahead = mask & (state > 2)
+        state[ahead] += 1
+        rest = mask & ~(won_race | start | ahead)
+        state[rest] = self.lead(i)[rest]
+        return won_race
+
+    def honest_block(self, mask):
+        """
+        the honest pool found a block, on the selfish branch of a 0' race
+        with probability gamma
+        """
+        self.mined[HONEST][mask] += 1
+        on_selfish = mask & (self.rng.random(self.replicates) < self.gamma)
+        in_race_0 = on_selfish & (self.state[S01] == TIE)
+        in_race_1 = on_selfish & (self.state[S02] == TIE) & ~in_race_0
+        self._adopt(S01, in_race_0)
+        self._adopt(S02, in_race_1)
+        self.height[mask] += 1
+        self.counts[HONEST][mask] += 1
+        return mask
+
+    def public_block(self, i: int, mask):
+        """
+        selfish miner i sees a longer public chain, returns where it
+        released enough blocks to take over the public chain
+        """
+        lead = self.lead(i)
+        state = self.state[i]
+
+        behind = mask & (lead < 0)
+        lost_race = mask & ~behind & ((state == TIE) | (state == 0))
+        # 1 -> 0': publish the withheld block and race
+        race = mask & ~behind & (state == 1) & (lead == 0)
+        # 2 -> 0: publish everything, the private branch is longer
+        override = mask & ~behind & (state == 2) & (lead == 1)
+        # >2: publish one block, stay ahead
+        ahead = mask & ~behind & (state > 2)
+        rest = mask & ~(behind | lost_race | race | override | ahead)
+
+        self._rebase(i, behind | lost_race)
+
+        self.hidden[i][race] = 0
+        state[race] = TIE
+
+        self.hidden[i][override] = 0
+        self._adopt(i, override)
+        self._rebase(i, override)
+
+        self.hidden[i][ahead] -= 1
+        state[ahead] -= 1
+
+        state[rest] = lead[rest]
+        return override
+
+    def step(self, miner):
+        changed = [
+            self.own_block(S01, miner == S01),
+            self.own_block(S02, miner == S02),
+        ]
+        honest = self.honest_block(miner == HONEST)
+        # S01 taking over the public chain is a new public chain for S02 and
+        # the other way round, repeat until nobody releases anymore
+        pending = [honest | changed[S02], honest | changed[S01]]
+        while pending[S01].any() or pending[S02].any():
+            for i in (S01, S02):
+                if pending[i].any():
+                    released = self.public_block(i, pending[i])
+                    pending[i] = np.zeros(self.replicates, dtype=bool)
+                    pending[1 - i] |= released
+
+    def run(self, num_blocks: int):
+        p = [self.z1, self.z2, 1 - self.z1 - self.z2]
+        for _ in range(num_blocks):
+            self.step(self.rng.choice(3, size=self.replicates, p=p))
+
+    def final_chain(self):
+        """
+        longest chain once all withheld blocks are published,
+        the public chain wins ties
+        """
+        height = self.height.copy()
+        counts = self.counts.copy()
+        for i in (S01, S02):
+            branch_height = self.base[i] + self.private[i]
+            longer = branch_height > height
+            height[longer] = branch_height[longer]
+            counts[:, longer] = self.base_counts[i][:, longer]
+            counts[i][longer] += self.private[i][longer]
+        return height, counts
+
+    def mpu_ratios(self) -> list[dict]:
+        """
+        same fields as simulation.calculate_mpu_ratios, averaged over replicates,
+        with the standard error of the two ratios
+        """
+        height, counts = self.final_chain()
+        # the genesis block is part of every chain
+        chain_length = height + 1
+        mined_by_all = self.mined.sum(axis=0) + 1
+        mpu_overall = chain_length / mined_by_all
+        ratios = []
+        for miner, (name, peer_id, peer_type) in enumerate(MINERS):
+            mined = self.mined[miner]
+            mpu_adv = np.divide(
+                counts[miner], mined, out=np.zeros(self.replicates), where=mined > 0
+            )
+            ratios.append(
+                {
+                    "peer": name,
+                    "peer_id": peer_id,
+                    "type": peer_type,
+                    "mpu_adv": float(mpu_adv.mean()),
+                    "mpu_overall": float(mpu_overall.mean()),
+                    "num_blocks_public_chain_by_peer": float(counts[miner].mean()),
+                    "num_blocks_public_chain_by_all": float(chain_length.mean()),
+                    "num_blocks_mined_by_peer": float(mined.mean()),
+                    "num_blocks_mined_by_all": float(mined_by_all.mean()),
+                    "mpu_adv_stderr": float(
+                        mpu_adv.std(ddof=1) / np.sqrt(self.replicates)
+                    ),
+                    "mpu_overall_stderr": float(
+                        mpu_overall.std(ddof=1) / np.sqrt(self.replicates)
+                    ),
+                    "replicates": self.replicates,
+                }
+            )
+        return ratios
+
+
+def simulate(
+    z1: float = CONFIG.Z1,
+    z2: float = CONFIG.Z2,
+    gamma: float = 0.5,
+    num_blocks: int = CONFIG.MAX_NUM_BLOCKS,
+    replicates: int = 1000,
+    seed: int = None,
+) -> list[dict]:
+    """
+    MPU ratios of S01, S02 and the honest pool after num_blocks blocks
+    """
+    model = DoubleSelfishMining(
+        replicates, z1, z2, gamma, np.random.default_rng(seed)
+    )
+    model.run(num_blocks)
+    return model.mpu_ratios()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--z1", type=float, default=CONFIG.Z1)
+    parser.add_argument("--z2", type=float, default=CONFIG.Z2)
+    parser.add_argument("--gamma", type=float, default=0.5)
+    parser.add_argument("--blocks", type=int, default=CONFIG.MAX_NUM_BLOCKS)
+    parser.add_argument("--replicates", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=CONFIG.SEED)
+    args = parser.parse_args()
+    ratios = simulate(
+        args.z1, args.z2, args.gamma, args.blocks, args.replicates, args.seed
+    )
+    print(json.dumps(ratios, indent=4))
+
+
+if __name__ == "__main__":
+    main()
@@ -18,7 +18,7 @@ def is_connected(peers: list[Peer]):
         for peer in cur_peer.neighbours.keys():
             if peer.id not in is_visited:
                 queue.append(peer)
-    return all(is_visited)
+    return len(is_visited) == len(peers)
 
 
 def draw_graph(peers):
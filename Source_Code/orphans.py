@@ -0,0 +1,85 @@
+import logging
+from collections import OrderedDict
+
+from Block import Block
+
+logger = logging.getLogger(__name__)
+
+
+class OrphanPool:
+    """
+    Blocks received before their parent, indexed by the id of the missing
+    parent so that a new block only looks at the orphans waiting for it.
+    At most max_size orphans are kept, the oldest is evicted first, and
+    orphans older than timeout (ms of simulation time) are dropped.
+    """
+
+    def __init__(self, max_size: int, timeout: float = None):
+        self.max_size = max_size
+        self.timeout = timeout
+        # missing parent id -> {block id: orphan}
+        self._by_parent: dict[int, dict[int, Block]] = {}
+        # block id -> (orphan, arrival time), oldest first
+        self._arrival: OrderedDict[int, tuple[Block, float]] = OrderedDict()
+        self.evicted = 0
+
+    def __len__(self) -> int:
+        return len(self._arrival)
+
+    def __contains__(self, block: Block) -> bool:
+        return block.block_id in self._arrival
+
+    def add(self, block: Block, now: float):
+        if block.block_id in self._arrival:
+            return
+        self.evict_expired(now)
+        while len(self._arrival) >= self.max_size:
+            self._evict(next(iter(self._arrival)))
+        self._arrival[block.block_id] = (block, now)
+        self._by_parent.setdefault(block.prev_block.block_id, {})[
+            block.block_id
+        ] = block
+
+    def pop_children(self, parent: Block) -> list[Block]:
+        """
+        remove and return the orphans waiting for parent
+        """
+        children = self._by_parent.pop(parent.block_id, None)
+        if not children:
+            return []
+        for block_id in children:
+            del self._arrival[block_id]
+        return list(children.values())
+
+    def evict_expired(self, now: float):
+        if self.timeout is None:
+            return
+        while self._arrival:
+            block_id, (_, arrived_at) = next(iter(self._arrival.items()))
+            if now - arrived_at <= self.timeout:
+                return
+            self._evict(block_id)
+
+    def evict_if(self, predicate):
+        """
+        evict the orphans predicate(orphan) is true for
+        """
+        for block_id in [
+            block_id
+            for block_id, (block, _) in self._arrival.items()
+            if predicate(block)
+        ]:
+            self._evict(block_id)
+
+    def _evict(self, block_id: int):
+        block, _ = self._arrival.pop(block_id)
+        parent_id = block.prev_block.block_id
+        siblings = self._by_parent[parent_id]
+        del siblings[block_id]
+        if not siblings:
+            del self._by_parent[parent_id]
+        self.evicted += 1
+        logger.info("orphan %s evicted", block)
+
+    def blocks(self) -> list[Block]:
+        return [block for block, _ in self._arrival.values()]
@@ -0,0 +1,401 @@
+"""
+Conservative parallel discrete event simulation.
+
+Peers are split into logical processes, one per worker process. Peers only
+interact through OneWayLINK deliveries, which take at least the link's pij
+(>= 10 ms), so with lookahead L = min pij over links between partitions no
+event in the window [T, T + L) can be affected by another partition, T being
+the earliest pending event anywhere. Workers run their window in parallel and
+the coordinator exchanges the link deliveries at the window boundary.
+
+Workers are forked after the network and the initial events are created, so
+every worker starts from the same state and owns the events of its peers.
+Blocks and transactions crossing partitions are sent by value and mapped back
+to one local object per id. Random draws come from per peer / chain / link
+streams (utils.spawn_rng), which makes a run independent of the interleaving
+of partitions: until the block target is reached the parallel run executes
+the same events as the sequential one under the same seed. The block target
+is detected at window granularity, so the shutdown can start up to one
+lookahead later than in the sequential engine.
+"""
+
+import math
+import heapq
+import logging
+import traceback
+import multiprocessing
+from collections import deque
+
+from Block import Block, GENESIS_BLOCK, GENESIS_BLOCK_ID
+from Transaction import Transaction, CoinBaseTransaction
+from BlockChainBase import BlockChainBase
+from DiscreteEventSim import simulation, Event, EventType
+
+logger = logging.getLogger(__name__)
+
+
+def partition_peers(peers: list, num_partitions: int) -> list[list]:
+    """
+    Split peers into num_partitions groups of neighbouring peers
+    (consecutive runs of a breadth first order), which keeps most links
+    inside a partition.
+    """
+    order = []
+    visited = set()
+    for start in peers:
+        if start in visited:
+            continue
+        visited.add(start)
+        queue = deque([start])
+        while queue:
+            peer = queue.popleft()
+            order.append(peer)
+            for neighbour in peer.neighbours:
+                if neighbour not in visited:
+                    visited.add(neighbour)
+                    queue.append(neighbour)
+    size = math.ceil(len(order) / num_partitions)
+    return [order[i : i + size] for i in range(0, len(order), size)]
+
+
+def partition_lookahead(partitions: list[list]) -> float:
+    """
+    minimum propagation delay over links between different partitions
+    """
+    rank_of = {peer: rank for rank, partition in enumerate(partitions) for peer in partition}
+    lookahead = math.inf
+    for peer, rank in rank_of.items():
+        for neighbour, link in peer.neighbours_meta.items():
+            if rank_of[neighbour] != rank:
+                lookahead = min(lookahead, link.pij)
+    return lookahead
+
+
+def event_peer(event: Event):
+    """
+    peer whose state the event changes
+    """
+    target = event.action.__self__
+    if isinstance(target, BlockChainBase):
+        return target.peer_id
+    return target
+
+
+class MessageCodec:
+    """
+    Encodes blocks and transactions as plain tuples between workers and
+    decodes them into a single local object per id.
+    """
+
+    def __init__(self, peers: list):
+        self.peer_by_id = {peer.id: peer for peer in peers}
+        self.blocks: dict[int, Block] = {GENESIS_BLOCK_ID: GENESIS_BLOCK}
+        self.txns: dict[int, Transaction] = {}
+        # block ids each other worker already has
+        self.known_by: dict[int, set] = {}
+
+    def encode_txn(self, txn: Transaction) -> tuple:
+        self.txns[txn.txn_id] = txn
+        return (
+            txn.txn_id,
+            txn.from_id.id if txn.from_id else None,
+            txn.to_id.id,
+            txn.amount,
+            txn.timestamp,
+            isinstance(txn, CoinBaseTransaction),
+        )
+
+    def decode_txn(self, row: tuple) -> Transaction:
+        txn_id, from_id, to_id, amount, timestamp, is_coinbase = row
+        txn = self.txns.get(txn_id)
+        if txn is None:
+            cls = CoinBaseTransaction if is_coinbase else Transaction
+            txn = self.txns[txn_id] = cls.__new__(cls)
+            txn.txn_id = txn_id
+            txn.from_id = self.peer_by_id[from_id] if from_id is not None else None
+            txn.to_id = self.peer_by_id[to_id]
+            txn.amount = amount
+            txn.timestamp = timestamp
+            txn.finalized = False
+        return txn
+
+    def encode_block(self, block: Block, rank: int) -> tuple[int, list[tuple]]:
+        """
+        id of block and rows for block and every ancestor worker rank does
+        not have yet, oldest first
+        """
+        known = self.known_by.setdefault(rank, {GENESIS_BLOCK_ID})
+        block_id = block.block_id
+        rows = []
+        while block.block_id not in known:
+            known.add(block.block_id)
+            self.blocks[block.block_id] = block
+            rows.append(
+                (
+                    block.block_id,
+                    block.prev_block.block_id,
+                    [self.encode_txn(txn) for txn in block.transactions],
+                    block.timestamp,
+                    block.miner.id,
+                    block.prev_block_hash,
+                )
+            )
+            block = block.prev_block
+        rows.reverse()
+        return block_id, rows
+
+    def decode_block(self, encoded: tuple[int, list[tuple]], rank: int) -> Block:
+        """
+        the block of encode_block, rows is empty when this worker already
+        has it (a block relayed over several links)
+        """
+        message_id, rows = encoded
+        known = self.known_by.setdefault(rank, {GENESIS_BLOCK_ID})
+        for block_id, prev_id, txns, timestamp, miner_id, prev_hash in rows:
+            known.add(block_id)
+            if block_id in self.blocks:
+                continue
+            block = self.blocks[block_id] = Block.__new__(Block)
+            block.block_id = block_id
+            block.prev_block = self.blocks[prev_id]
+            block.transactions = [self.decode_txn(txn) for txn in txns]
+            block.timestamp = timestamp
+            block.miner = self.peer_by_id[miner_id]
+            # only published blocks reach other peers
+            block.is_private = False
+            block.prev_block_hash = prev_hash
+            block.index = -1
+        return self.blocks[message_id]
+
+
+class Worker:
+    """
+    One logical process: runs the events of its peers window by window
+    and hands deliveries to peers of other partitions to the coordinator.
+    """
+
+    def __init__(self, rank: int, partitions: list[list], peers: list, conn):
+        self.rank = rank
+        self.conn = conn
+        self.peers = partitions[rank]
+        self.local = set(self.peers)
+        self.rank_of = {peer: r for r, partition in enumerate(partitions) for peer in partition}
+        self.codec = MessageCodec(peers)
+        self.outbox: list[tuple] = []
+        self.success_times: list[float] = []
+
+    def setup(self):
+        simulation.completed_event_counter.disable = True
+        simulation.scheduled_event_counter.disable = True
+        simulation.ids.partition(self.rank, len(set(self.rank_of.values())))
+        with simulation.event_queue.mutex:
+            queue = [
+                event
+                for event in simulation.event_queue.queue
+                if event_peer(event) in self.local
+            ]
+            heapq.heapify(queue)
+            simulation.event_queue.queue = queue
+        simulation.router = self.route
+        simulation.reg_run_hooks(self.count_success)
+
+    def count_success(self, event: Event):
+        if event.type == EventType.BLOCK_MINE_SUCCESS and not simulation.stop_sim:
+            self.success_times.append(simulation.clock)
+
+    def route(self, event: Event) -> bool:
+        if event.type not in (EventType.TXN_RECEIVE, EventType.BLOCK_RECEIVE):
+            return False
+        to_peer = event.action.__self__
+        if to_peer in self.local:
+            return False
+        rank = self.rank_of[to_peer]
+        msg, from_peer = event.payload
+        if event.type == EventType.TXN_RECEIVE and isinstance(msg, tuple):
+            encoded = [self.codec.encode_txn(txn) for txn in msg]
+        elif event.type == EventType.TXN_RECEIVE:
+            encoded = self.codec.encode_txn(msg)
+        else:
+            encoded = self.codec.encode_block(msg, rank)
+        self.outbox.append(
+            (
+                rank,
+                (
+                    self.rank,
+                    event.type,
+                    event.created_at,
+                    event.actionable_at,
+                    to_peer.id,
+                    from_peer.id,
+                    encoded,
+                    event.meta_description,
+                ),
+            )
+        )
+        return True
+
+    def deliver(self, message: tuple):
+        src, event_type, created_at, actionable_at, to_id, from_id, encoded, desc = message
+        to_peer = self.codec.peer_by_id[to_id]
+        action = to_peer.receive_msg
+        if event_type == EventType.TXN_RECEIVE and isinstance(encoded, list):
+            msg = tuple(self.codec.decode_txn(row) for row in encoded)
+            action = to_peer.receive_txns
+        elif event_type == EventType.TXN_RECEIVE:
+            msg = self.codec.decode_txn(encoded)
+        else:
+            msg = self.codec.decode_block(encoded, src)
+        event = Event(
+            event_type,
+            created_at,
+            actionable_at - created_at,
+            action,
+            (msg, self.codec.peer_by_id[from_id]),
+            desc,
+        )
+        event.actionable_at = actionable_at
+        simulation.enqueue(event)
+
+    def stop(self, clock: float):
+        """
+        block target reached: withheld blocks are broadcast and the block
+        deliveries drain, workers cannot merge blocks of each other's peers
+        like the sequential reconcile_chains does
+        """
+        simulation.clock = max(simulation.clock, clock)
+        for peer in self.peers:
+            peer.publish_withheld_blocks()
+        simulation.stop_sim = True
+
+    def serve(self, collect):
+        self.setup()
+        while True:
+            command, *args = self.conn.recv()
+            if command == "window":
+                window_end, inbound, stop_clock = args
+                if stop_clock is not None and not simulation.stop_sim:
+                    self.stop(stop_clock)
+                for message in inbound:
+                    self.deliver(message)
+                simulation.run(until=window_end)
+                self.conn.send(
+                    (simulation.next_event_time(), self.success_times, self.outbox)
+                )
+                self.success_times = []
+                self.outbox = []
+            elif command == "finish":
+                for peer in self.peers:
+                    peer.block_chain._panic_validate_saved_blocks()
+                self.conn.send([(peer.id, collect(peer)) for peer in self.peers])
+                return
+
+
+class WorkerError(Exception):
+    """
+    a worker failed, carries its traceback to the coordinator
+    """
+
+
+def _worker_main(rank, partitions, peers, conn, collect):
+    try:
+        Worker(rank, partitions, peers, conn).serve(collect)
+    except Exception:
+        conn.send(WorkerError(f"worker {rank}:\n{traceback.format_exc()}"))
+        raise
+
+
+def _receive(conn):
+    reply = conn.recv()
+    if isinstance(reply, WorkerError):
+        raise reply
+    return reply
+
+
+def run_parallel(
+    peers: list,
+    num_workers: int,
+    max_blocks: int,
+    collect,
+    until: float = math.inf,
+) -> list:
+    """
+    Run the already initialised simulation over num_workers processes.
+    collect(peer) runs in the worker owning peer after the run, its return
+    values are returned in the order of peers.
+    """
+    if simulation.mining_scheduler:
+        raise ValueError("the global mining scheduler needs all peers in one process")
+    if simulation.trace_recorder:
+        raise ValueError("the binary event trace is only written by serial runs")
+    if simulation.checkpointing:
+        # forked workers would each write their partition to the same file
+        raise ValueError("checkpoints are only written by serial runs")
+    partitions = partition_peers(peers, num_workers)
+    lookahead = partition_lookahead(partitions)
+    num_workers = len(partitions)
+    logger.info(
+        "parallel run: %s workers, partition sizes %s, lookahead %s ms",
+        num_workers,
+        [len(partition) for partition in partitions],
+        lookahead,
+    )
+
+    context = multiprocessing.get_context("fork")
+    conns = []
+    workers = []
+    for rank in range(num_workers):
+        parent_conn, child_conn = context.Pipe()
+        worker = context.Process(
+            target=_worker_main,
+            args=(rank, partitions, peers, child_conn, collect),
+            daemon=True,
+        )
+        worker.start()
+        conns.append(parent_conn)
+        workers.append(worker)
+
+    inbound = [[] for _ in range(num_workers)]
+    next_times = []
+    for conn in conns:
+        conn.send(("window", -math.inf, [], None))
+    for conn in conns:
+        next_times.append(_receive(conn)[0])
+    blocks_mined = 0
+    stop_clock = None
+    stop_sent = False
+    windows = 0
+    while True:
+        earliest = min(
+            min(next_times),
+            min((msg[3] for box in inbound for msg in box), default=math.inf),
+        )
+        if earliest == math.inf or earliest >= until:
+            break
+        window_end = min(earliest + lookahead, until)
+        send_stop = stop_clock if stop_clock is not None and not stop_sent else None
+        stop_sent = stop_sent or send_stop is not None
+        for rank, conn in enumerate(conns):
+            conn.send(("window", window_end, inbound[rank], send_stop))
+        inbound = [[] for _ in range(num_workers)]
+        success_times = []
+        for rank, conn in enumerate(conns):
+            next_times[rank], successes, outbox = _receive(conn)
+            success_times += successes
+            for dest, message in outbox:
+                inbound[dest].append(message)
+        windows += 1
+
+        if stop_clock is None and blocks_mined + len(success_times) > max_blocks:
+            success_times.sort()
+            stop_clock = success_times[max_blocks - blocks_mined]
+        blocks_mined += len(success_times)
+
+    for conn in conns:
+        conn.send(("finish",))
+    collected = {}
+    for conn in conns:
+        collected.update(_receive(conn))
+    for worker in workers:
+        worker.join()
+    logger.info("parallel run finished after %s windows", windows)
+    return [collected[peer.id] for peer in peers]
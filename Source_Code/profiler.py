@@ -0,0 +1,117 @@
+from time import perf_counter
+
+
+class EventProfiler:
+    """
+    Per event type / per handler timing of the simulation loop.
+    Only used when profiling is enabled, the normal run loop never touches it.
+    """
+
+    def __init__(self, rate_interval: float = 1.0):
+        self.rate_interval = rate_interval  # wall seconds between rate samples
+        self.by_type: dict = {}  # EventType -> [count, wall_time, queue_depth_sum, queue_depth_max]
+        self.by_handler: dict = {}  # handler name -> [count, wall_time]
+        self.rate_samples: list[tuple] = []  # (wall_elapsed, sim_clock, events, events/sec)
+
+        self.total_events = 0
+        self.start_time = None
+        self.end_time = None
+        self._last_sample_time = None
+        self._last_sample_events = 0
+
+    @staticmethod
+    def handler_name(action) -> str:
+        return getattr(action, "__qualname__", None) or repr(action)
+
+    def start(self):
+        self.start_time = perf_counter()
+        self._last_sample_time = self.start_time
+
+    def stop(self):
+        self.end_time = perf_counter()
+
+    def record(self, event, elapsed: float, queue_depth: int, clock: float, now: float):
+        """
+        Account one executed event.
+        elapsed: wall time spent in the handler, now: perf_counter() after it ran
+        """
+        self.total_events += 1
+
+        type_stats = self.by_type.get(event.type)
+        if type_stats is None:
+            type_stats = self.by_type[event.type] = [0, 0.0, 0, 0]
+        type_stats[0] += 1
+        type_stats[1] += elapsed
+        type_stats[2] += queue_depth
+        if queue_depth > type_stats[3]:
+            type_stats[3] = queue_depth
+
+        name = self.handler_name(event.action)
+        handler_stats = self.by_handler.get(name)
+        if handler_stats is None:
+            handler_stats = self.by_handler[name] = [0, 0.0]
+        handler_stats[0] += 1
+        handler_stats[1] += elapsed
+
+        if now - self._last_sample_time >= self.rate_interval:
+            self.sample_rate(clock, now)
+
+    def sample_rate(self, clock: float, now: float):
+        window = now - self._last_sample_time
+        events = self.total_events - self._last_sample_events
+        rate = events / window if window > 0 else 0.0
+        self.rate_samples.append(
+            (now - self.start_time, clock, self.total_events, rate)
+        )
+        self._last_sample_time = now
+        self._last_sample_events = self.total_events
+
+    @property
+    def wall_time(self) -> float:
+        if self.start_time is None:
+            return 0.0
+        end = self.end_time if self.end_time is not None else perf_counter()
+        return end - self.start_time
+
+    def summary(self) -> str:
+        """
+        human readable summary table
+        """
+        total_time = sum(stats[1] for stats in self.by_type.values()) or 1e-12
+        wall_time = self.wall_time
+        lines = [
+            f"events: {self.total_events}  wall: {wall_time:.3f}s  "
+            f"rate: {self.total_events / wall_time if wall_time else 0:.1f} events/s",
+            "",
+            f"{'event type':<24}{'count':>10}{'total(s)':>12}{'mean(us)':>12}{'share':>8}{'avg q':>10}{'max q':>10}",
+        ]
+        for event_type, (count, elapsed, depth_sum, depth_max) in sorted(
+            self.by_type.items(), key=lambda x: x[1][1], reverse=True
+        ):
+            lines.append(
+                f"{str(event_type):<24}{count:>10}{elapsed:>12.4f}"
+                f"{elapsed / count * 1e6:>12.2f}{elapsed / total_time:>8.1%}"
+                f"{depth_sum / count:>10.1f}{depth_max:>10}"
+            )
+        lines += [
+            "",
+            f"{'handler':<48}{'count':>10}{'total(s)':>12}{'mean(us)':>12}{'share':>8}",
+        ]
+        for name, (count, elapsed) in sorted(
+            self.by_handler.items(), key=lambda x: x[1][1], reverse=True
+        ):
+            lines.append(
+                f"{name:<48}{count:>10}{elapsed:>12.4f}"
+                f"{elapsed / count * 1e6:>12.2f}{elapsed / total_time:>8.1%}"
+            )
+        lines += [
+            "",
+            f"{'wall(s)':>10}{'sim clock':>16}{'events':>10}{'events/s':>12}",
+        ]
+        for wall, clock, events, rate in self.rate_samples:
+            lines.append(f"{wall:>10.2f}{clock:>16.2f}{events:>10}{rate:>12.1f}")
+        return "\n".join(lines)
+
+    def write_summary(self, path: str = "profile_summary.txt"):
+        with open(path, "w") as f:
+            f.write(self.summary() + "\n")
@@ -0,0 +1,269 @@
+import math
+from typing import Any
+from array import array
+
+import numpy as np
+
+
+def _grow(column: array, size: int, fill):
+    if len(column) < size:
+        column.extend([fill] * (size - len(column)))
+
+
+class BlockRegistry:
+    """
+    Every block accepted by some peer, stored once for the whole simulation
+    and numbered densely (Block.index) in order of first acceptance.
+    Height and skip pointer (see ChainIndex) only depend on a block's
+    ancestors, so they are kept here once instead of in every peer.
+
+    With finality every peer reports its final block (track_final). Once all
+    of them finalized a block, the rows below it are dropped and it is cut
+    from its parent, so older blocks and their transactions can be freed:
+    rows start at base, len() still counts every block ever registered.
+    """
+
+    def __init__(self):
+        self.blocks: list = []
+        self.height = array("l")
+        self.jump = array("l")
+        self.base = 0  # index of blocks[0]
+        self._dicts: dict[int, dict] = {}
+        # index -> time the miner first published the block (hybrid.py)
+        self.release_time: dict[int, float] = {}
+        # peer id -> (final block, its height), final heights -> peers there
+        self._finals: dict[Any, tuple] = {}
+        self._final_heights: dict[int, int] = {}
+        self._lowest_final = 0  # min(_final_heights) when final was last set
+        self.final = None  # block every peer finalized
+        self.final_height = 0
+
+    def __len__(self) -> int:
+        return self.base + len(self.blocks)
+
+    def block(self, index: int):
+        return self.blocks[index - self.base]
+
+    def is_pruned(self, block) -> bool:
+        """
+        block was registered but its row is dropped, it is below final
+        """
+        return 0 <= block.index < self.base
+
+    def register(self, block) -> int:
+        if block.index >= 0:
+            return block.index
+        index = len(self)
+        if block.prev_block is None:
+            height, jump = 1, index
+        else:
+            base = self.base
+            parent = block.prev_block.index - base
+            height = self.height[parent] + 1
+            skip = self.jump[parent] - base
+            if skip >= 0 and self.jump[skip] >= base and (
+                self.height[parent] - self.height[skip]
+                == self.height[skip] - self.height[self.jump[skip] - base]
+            ):
+                jump = self.jump[skip]
+            else:
+                # also when the pointers lead below base, queries never go there
+                jump = parent + base
+        block.index = index
+        self.blocks.append(block)
+        self.height.append(height)
+        self.jump.append(jump)
+        return index
+
+    def ancestor_index(self, index: int, height: int) -> int:
+        base = self.base
+        heights = self.height
+        jumps = self.jump
+        blocks = self.blocks
+        while heights[index - base] > height:
+            jump = jumps[index - base]
+            if jump >= base and heights[jump - base] >= height:
+                index = jump
+            else:
+                index = blocks[index - base].prev_block.index
+        return index
+
+    def common_ancestor(self, a, b):
+        base = self.base
+        heights = self.height
+        jumps = self.jump
+        blocks = self.blocks
+        a, b = a.index, b.index
+        if heights[a - base] > heights[b - base]:
+            a = self.ancestor_index(a, heights[b - base])
+        else:
+            b = self.ancestor_index(b, heights[a - base])
+        while a != b:
+            # a and b are at the same height, so are their jumps unless one
+            # was registered after its skew pointers were dropped
+            jump_a, jump_b = jumps[a - base], jumps[b - base]
+            if (
+                jump_a != jump_b
+                and min(jump_a, jump_b) >= base
+                and heights[jump_a - base] == heights[jump_b - base]
+            ):
+                a, b = jump_a, jump_b
+            else:
+                a = blocks[a - base].prev_block.index
+                b = blocks[b - base].prev_block.index
+        return blocks[a - base]
+
+    def track_final(self, peer_id, block):
+        """
+        block is the final block of peer_id now (BlockChainBase finality),
+        prunes below the common ancestor of all final blocks when it moves up
+        """
+        heights = self._final_heights
+        old = self._finals.get(peer_id)
+        if old is not None:
+            heights[old[1]] -= 1
+            if not heights[old[1]]:
+                del heights[old[1]]
+        height = self.height[block.index - self.base]
+        self._finals[peer_id] = (block, height)
+        heights[height] = heights.get(height, 0) + 1
+        if self.final is None:
+            self.final = block
+            self.final_height = self._lowest_final = height
+        elif min(heights) > self._lowest_final:
+            self._lowest_final = min(heights)
+            finals = iter(self._finals.values())
+            final = next(finals)[0]
+            for other, _ in finals:
+                final = self.common_ancestor(final, other)
+            self._prune(final)
+
+    def _prune(self, final):
+        """
+        final is finalized by every peer: mark the transactions up to it,
+        cut it from its parent and drop the rows below it. Rows are numbered
+        in order of first acceptance, a block's descendants come after it,
+        so none of the dropped rows descends from final.
+        """
+        if final is self.final:
+            return
+        block = final
+        while block is not None and block is not self.final:
+            for transaction in block.transactions:
+                transaction.finalized = True
+            block = block.prev_block
+        self.final = final
+        self.final_height = self.height[final.index - self.base]
+        final.prev_block = None
+        shift = final.index - self.base
+        if not shift:
+            return
+        del self.blocks[:shift]
+        del self.height[:shift]
+        del self.jump[:shift]
+        self.base = final.index
+        for column in (self._dicts, self.release_time):
+            for index in [index for index in column if index < self.base]:
+                del column[index]
+
+    def mark_released(self, block, time: float):
+        self.release_time.setdefault(block.index, time)
+
+    def block_dict(self, block) -> dict:
+        """
+        block.to_dict(), built once per export for all peers
+        """
+        exported = self._dicts.get(block.index)
+        if exported is None:
+            exported = self._dicts[block.index] = block.to_dict()
+        return exported
+
+    def arrival_matrix(self, views: list["BlockView"]) -> np.ndarray:
+        """
+        peers x blocks (registry rows) arrival times, nan where a peer does
+        not know a block
+        """
+        matrix = np.full((len(views), len(self.blocks)), np.nan, dtype=np.float32)
+        for row, view in enumerate(views):
+            # columns are registry rows from base on, views may start below
+            start = view.offset - self.base
+            arrival = view.arrival[max(-start, 0) :]
+            start = max(start, 0)
+            matrix[row, start : start + len(arrival)] = arrival
+        return matrix
+
+    def propagation_delays(self, views: list["BlockView"]) -> np.ndarray:
+        """
+        per peer and block, time since the first peer had the block
+        """
+        matrix = self.arrival_matrix(views)
+        return matrix - np.nanmin(matrix, axis=0)
+
+
+class BlockView:
+    """
+    The blocks one peer knows: a bitset over registry indices, the indices in
+    order of arrival and a float32 arrival time column (nan when unknown).
+    Columns start at offset, the registry index of their first entry, which
+    moves up when old blocks are pruned (see BlockChainBase finality).
+    """
+
+    def __init__(self, registry: BlockRegistry):
+        self.registry = registry
+        self.offset = 0  # multiple of 8, so the bitset shifts by whole bytes
+        self.known = bytearray()
+        self.order = array("i")
+        self.arrival = array("f")
+
+    def __len__(self) -> int:
+        return len(self.order)
+
+    def __contains__(self, block) -> bool:
+        index = block.index - self.offset
+        return (
+            index >= 0
+            and (index >> 3) < len(self.known)
+            and self.known[index >> 3] >> (index & 7) & 1
+        )
+
+    def __iter__(self):
+        block = self.registry.block
+        return (block(index) for index in self.order)
+
+    def add(self, block, arrival_time: float):
+        index = self.registry.register(block) - self.offset
+        _grow(self.known, (index >> 3) + 1, 0)
+        _grow(self.arrival, index + 1, math.nan)
+        self.known[index >> 3] |= 1 << (index & 7)
+        self.arrival[index] = arrival_time
+        self.order.append(block.index)
+
+    def _clear(self, block):
+        index = block.index - self.offset
+        self.known[index >> 3] &= ~(1 << (index & 7))
+        self.arrival[index] = math.nan
+
+    def remove(self, block):
+        self._clear(block)
+        self.order.remove(block.index)
+
+    def drop(self, blocks: list) -> int:
+        """
+        forget blocks and cut the columns below the oldest block left,
+        returns by how many entries the offset moved
+        """
+        for block in blocks:
+            self._clear(block)
+        dropped = {block.index for block in blocks}
+        self.order = array("i", (i for i in self.order if i not in dropped))
+        shift = (min(self.order, default=self.offset) - self.offset) & ~7
+        del self.known[: shift >> 3]
+        del self.arrival[:shift]
+        self.offset += shift
+        return shift
+
+    def last(self):
+        return self.registry.block(self.order[-1])
+
+    def arrival_time(self, block) -> float:
+        return self.arrival[block.index - self.offset]
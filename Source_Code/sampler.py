@@ -0,0 +1,116 @@
+import csv
+import logging
+from time import perf_counter
+
+import psutil
+
+logger = logging.getLogger(__name__)
+
+COLUMNS = [
+    "sample",
+    "wall_time",  # s since the sampler started
+    "sim_time",  # ms
+    "events",
+    "events_per_sec",
+    "queue_depth",
+    "rss_mb",
+    "peer",
+    "mempool",
+    "orphans",
+    "tips",
+    "state",  # selfish peers only
+    "secret_blocks",  # selfish peers only
+]
+
+
+class StateSampler:
+    """
+    Time series of the simulator state, streamed to a CSV file with one row
+    per peer and sample. A sample is taken before the first event at or after
+    every sim_interval ms of simulation time and every wall_interval seconds,
+    whichever comes first (either may be None). The per event check is two
+    comparisons; a sample costs O(peers) and happens once per interval.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        simulation,
+        peers: list,
+        sim_interval: float = None,
+        wall_interval: float = None,
+    ):
+        self.path = path
+        self.simulation = simulation
+        self.peers = peers
+        self.sim_interval = sim_interval
+        self.wall_interval = wall_interval
+        self.samples = 0
+
+        self._file = open(path, "w", newline="")
+        self._writer = csv.writer(self._file)
+        self._writer.writerow(COLUMNS)
+        self._process = psutil.Process()
+
+        self._start = perf_counter()
+        self._next_sim_time = simulation.clock
+        self._next_wall_time = self._start
+        self._last_wall_time = self._start
+        self._last_events = simulation.events_executed
+
+    def __call__(self, event):
+        """
+        run hook, called before every event
+        """
+        if (
+            self.sim_interval is not None
+            and self.simulation.clock >= self._next_sim_time
+        ) or (self.wall_interval is not None and perf_counter() >= self._next_wall_time):
+            self.sample()
+
+    def sample(self):
+        simulation = self.simulation
+        now = perf_counter()
+        events = simulation.events_executed
+        window = now - self._last_wall_time
+        events_per_sec = (events - self._last_events) / window if window > 0 else 0.0
+        shared = [
+            self.samples,
+            round(now - self._start, 6),
+            simulation.clock,
+            events,
+            round(events_per_sec, 1),
+            simulation.event_queue.qsize(),
+            round(self._process.memory_info().rss / 2**20, 1),
+        ]
+        for peer in self.peers:
+            block_chain = peer.block_chain
+            secret_blocks = getattr(block_chain, "secret_blocks", None)
+            self._writer.writerow(
+                shared
+                + [
+                    repr(peer),
+                    block_chain.mempool_size(),
+                    block_chain.missing_parent_count(),
+                    block_chain.num_tips(),
+                    getattr(block_chain, "state", ""),
+                    "" if secret_blocks is None else len(secret_blocks),
+                ]
+            )
+        self._file.flush()
+
+        self.samples += 1
+        self._last_wall_time = now
+        self._last_events = events
+        if self.sim_interval is not None:
+            while self._next_sim_time <= simulation.clock:
+                self._next_sim_time += self.sim_interval
+        if self.wall_interval is not None:
+            self._next_wall_time = now + self.wall_interval
+
+    def close(self):
+        if self._file.closed:
+            return
+        self.sample()
+        self._file.close()
+        logger.info("%s samples written to %s", self.samples, self.path)
@@ -2,15 +2,18 @@ import random
 import json
 import pickle
 import sys
+import math
+import logging
+import argparse
 from time import time, strftime
 from tqdm import tqdm
+import numpy as np
 
-from logger import init_logger
+from logger import init_logger, stop_background_logging, EventTraceSink
 from network import is_connected, create_network, draw_graph
 from DiscreteEventSim import simulation, Event, EventType
 from Peer import Peer
 from Block import Block
-from BlockChainBase import BlockChainBase
 from utils import (
     expon_distribution,
     create_directory,
@@ -19,11 +22,20 @@ from utils import (
     clear_dir,
     delete_pattern,
 )
-from visualisation import visualize
+from checkpoint import save_checkpoint, load_checkpoint
+from pdes import run_parallel
+from mining import MiningScheduler
+from eventtrace import TraceRecorder
+from sampler import StateSampler
+from memprofile import MemoryAccounting
+from metrics import MetricsStream, mpu_ratio, REORG_FIELDS
+from hybrid import create_hybrid_network, load_propagation, save_propagation
 
 from config import CONFIG
 
-logger = init_logger()
+logger = init_logger(
+    level=getattr(logging, CONFIG.LOG_LEVEL), background=CONFIG.LOG_BACKGROUND
+)
 START_TIME = time()
 START_TIME = strftime("%Y-%m-%d_%H:%M:%S")
 
@@ -76,67 +88,42 @@ def calculate_mpu_ratios(peers: list[Peer]):
     """
     Calculate the mining power unit ratios of the peers.
     """
-
-    def calculate_mpu(peer: Peer):
-        """
-        Calculate the mining power unit of a peer.
-        """
-        block_chain: BlockChainBase = peer.block_chain
-        longest_chain_blocks = block_chain.get_longest_chain()
-        all_blocks = block_chain.get_blocks()
-
-        num_blocks_public_chain_by_peer = 0
-        for block in longest_chain_blocks:
-            if block.miner == peer:
-                num_blocks_public_chain_by_peer += 1
-        num_blocks_public_chain_by_all = len(longest_chain_blocks)
-
-        num_blocks_mined_by_peer = 0
-        for block in all_blocks:
-            if block.miner == peer:
-                num_blocks_mined_by_peer += 1
-        num_blocks_mined_by_all = len(all_blocks)
-
-        if num_blocks_mined_by_peer == 0:
-            mpu_adv = 0
-        else:
-            mpu_adv = num_blocks_public_chain_by_peer / num_blocks_mined_by_peer
-        mpu_overall = num_blocks_public_chain_by_all / num_blocks_mined_by_all
-
-        return {
-            "peer": peer.__repr__(),
-            "peer_id": peer.id,
-            "type": peer.type,
-            "mpu_adv": mpu_adv,
-            "mpu_overall": mpu_overall,
-            "num_blocks_public_chain_by_peer": num_blocks_public_chain_by_peer,
-            "num_blocks_public_chain_by_all": num_blocks_public_chain_by_all,
-            "num_blocks_mined_by_peer": num_blocks_mined_by_peer,
-            "num_blocks_mined_by_all": num_blocks_mined_by_all,
-        }
-
-    mpu_ratios = []
-    for peer in peers:
-        mpu_ratios.append(calculate_mpu(peer))
-    return mpu_ratios
+    return [mpu_ratio(peer) for peer in peers]
 
 
 def export_data(peers):
     """
     Export data to a file
     """
-    raw_data = []
     json_data = []
     for peer in peers:
-        json_data.append(peer.__dict__)
-        raw_data.append(peer)
+        json_data.append(peer.to_dict())
     mpu_ratios = calculate_mpu_ratios(peers)
-    json_data = {"peers": json_data, "mpu_ratios": mpu_ratios}
+    write_results(json_data, mpu_ratios)
+
+
+def write_results(peers_data: list[dict], mpu_ratios: list[dict]):
+    """
+    Write exported peers and mpu ratios to the result files
+    """
+    json_data = {"peers": peers_data, "mpu_ratios": mpu_ratios}
 
     if CONFIG.SAVE_RESULTS:
         output_dir = f"output/{CONFIG.TEST_CASE_NAME}"
         create_directory(output_dir)
         copy_to_directory("blockchain_simulation.log", output_dir)
+        if CONFIG.EVENT_TRACE_FILE:
+            copy_to_directory(CONFIG.EVENT_TRACE_FILE, output_dir)
+        if CONFIG.EVENT_TRACE_BINARY:
+            copy_to_directory(f"{CONFIG.EVENT_TRACE_BINARY}*", output_dir)
+        if CONFIG.FINALITY_SPILL_FILE:
+            copy_to_directory(CONFIG.FINALITY_SPILL_FILE, output_dir)
+        if CONFIG.SAMPLE_FILE:
+            copy_to_directory(CONFIG.SAMPLE_FILE, output_dir)
+        if CONFIG.METRICS_FILE:
+            copy_to_directory(CONFIG.METRICS_FILE, output_dir)
+        if CONFIG.PROPAGATION_FILE:
+            copy_to_directory(CONFIG.PROPAGATION_FILE, output_dir)
         copy_to_directory("config.py", output_dir)
         copy_to_directory("frames", output_dir)
         change_directory(output_dir)
@@ -150,7 +137,12 @@ def export_data(peers):
     with open("config.txt", "w") as f:
         for key, value in CONFIG.__dict__().items():
             f.write(f"{key} = {value}\n")
-    visualize(json_data)
+    if simulation.profiler:
+        simulation.profiler.write_summary("profile_summary.txt")
+    if CONFIG.VISUALIZE:
+        from visualisation import visualize
+
+        visualize(json_data)
 
 
 def setup_progressbars():
@@ -189,34 +181,203 @@ def update_progressbars(pbar_txns, pbar_blocks, event):
     if successful_blocks_mined > CONFIG.MAX_NUM_BLOCKS:
         if simulation.stop_sim:
             return
-        for peer in peers_network:
-            peer.flush_blocks()
-        print("Flushed blocks")
         simulation.stop_sim = True
+        simulation.end_run = True
 
 
-if __name__ == "__main__":
+def reconcile_chains(peers: list[Peer]):
+    """
+    End of run: selfish peers publish their withheld blocks and every peer
+    gets the blocks it is missing by a direct merge, instead of relaying
+    them hop by hop. Blocks in flight are dropped, the merge delivers them.
+    """
+    for peer in peers:
+        peer.publish_withheld_blocks(broadcast=False)
+    blocks = {block for peer in peers for block in peer.block_chain.get_blocks()}
+    blocks = sorted(blocks, key=lambda block: block.index)  # parents first
+    for peer in peers:
+        peer.block_chain.merge_blocks(blocks)
+    print("Reconciled chains")
 
-    delete_pattern("frames/peer_*")
 
-    peers_network = create_network(CONFIG.NUMBER_OF_PEERS)
-    logger.info("Network created")
-    print("Network created")
-    # draw_graph(peers_network)
+def checkpoint():
+    """
+    Save the simulation state to CONFIG.CHECKPOINT_FILE
+    """
+    save_checkpoint(
+        CONFIG.CHECKPOINT_FILE,
+        peers_network,
+        {"successful_blocks_mined": successful_blocks_mined},
+    )
+    if memory:
+        memory.snapshot(f"checkpoint {simulation.events_executed}")
+
+
+def collect_peer_results(peer: Peer):
+    """
+    runs in the worker process owning peer at the end of a parallel run,
+    without the reorg fields: the shutdown relays the withheld blocks hop
+    by hop instead of merging them, so they would not match a serial run
+    """
+    peer.block_chain.plot_frame()
+    ratios = calculate_mpu_ratios([peer])[0]
+    for field in REORG_FIELDS:
+        del ratios[field]
+    return peer.to_dict(), ratios
 
-    log_peers(peers_network)
-    schedule_transactions(peers_network)
-    logger.info("Transactions scheduled")
-    print("Transactions scheduled")
+
+def run_parallel_simulation(peers):
+    """
+    Run the simulation on CONFIG.PARALLEL_WORKERS processes, see pdes.py
+    """
+    results = run_parallel(
+        peers,
+        CONFIG.PARALLEL_WORKERS,
+        CONFIG.MAX_NUM_BLOCKS,
+        collect_peer_results,
+        until=CONFIG.MAX_SIM_TIME or math.inf,
+    )
+    print("Simulation ended")
+    stop_background_logging()
+    write_results(
+        [peer_data for (peer_data, _) in results],
+        [mpu_ratio for (_, mpu_ratio) in results],
+    )
+    logger.info("Data exported")
+    print("Data exported")
+
+
+def check_config():
+    """
+    fail before the run on settings that would crash it or be ignored
+    """
+    if CONFIG.HONEST_POOLS and not CONFIG.PROPAGATION_FILE:
+        raise ValueError("HONEST_POOLS needs the PROPAGATION_FILE of a full run")
+    if CONFIG.PARALLEL_WORKERS > 1:
+        serial_only = [
+            key
+            for key in ("SAMPLE_FILE", "METRICS_FILE", "MEMORY_PROFILE")
+            if getattr(CONFIG, key)
+        ]
+        if CONFIG.PROPAGATION_FILE and not CONFIG.HONEST_POOLS:
+            serial_only.append("PROPAGATION_FILE")
+        if serial_only:
+            raise ValueError(
+                f"{', '.join(serial_only)} only work with PARALLEL_WORKERS = 1"
+            )
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="double selfish mining simulation")
+    parser.add_argument(
+        "--resume",
+        nargs="?",
+        const=CONFIG.CHECKPOINT_FILE,
+        default=None,
+        metavar="CHECKPOINT",
+        help="continue from a checkpoint (default: CONFIG.CHECKPOINT_FILE)",
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    check_config()
+
+    memory = None
+    if CONFIG.MEMORY_PROFILE:
+        memory = MemoryAccounting(CONFIG.MEMORY_SNAPSHOT_INTERVAL, CONFIG.MEMORY_TOP_N)
+        memory.start()
+
+    if args.resume:
+        peers_network, extra = load_checkpoint(args.resume)
+        successful_blocks_mined = extra["successful_blocks_mined"]
+        logger.info("Resumed from %s", args.resume)
+        print(f"Resumed from {args.resume}")
+    else:
+        if CONFIG.SEED is not None:
+            random.seed(CONFIG.SEED)
+            np.random.seed(CONFIG.SEED)
+        delete_pattern("frames/peer_*")
+        if CONFIG.GLOBAL_MINING_SCHEDULER:
+            simulation.mining_scheduler = MiningScheduler()
+
+        if CONFIG.HONEST_POOLS:
+            peers_network = create_hybrid_network(
+                CONFIG.HONEST_POOLS, load_propagation(CONFIG.PROPAGATION_FILE)
+            )
+        else:
+            peers_network = create_network(CONFIG.NUMBER_OF_PEERS)
+        logger.info("Network created")
+        print("Network created")
+        # draw_graph(peers_network)
+
+        log_peers(peers_network)
+        schedule_transactions(peers_network)
+        logger.info("Transactions scheduled")
+        print("Transactions scheduled")
+
+    if CONFIG.CHECKPOINT_INTERVAL:
+        simulation.set_checkpointing(checkpoint, CONFIG.CHECKPOINT_INTERVAL)
+
+    if CONFIG.EVENT_TRACE_FILE:
+        simulation.set_trace_sink(
+            EventTraceSink(CONFIG.EVENT_TRACE_FILE, background=CONFIG.LOG_BACKGROUND)
+        )
+    if CONFIG.EVENT_TRACE_BINARY:
+        simulation.trace_recorder = TraceRecorder(
+            CONFIG.EVENT_TRACE_BINARY,
+            peers_network,
+            simulation.block_registry,
+            CONFIG.__dict__(),
+        )
+    if CONFIG.FINALITY_SPILL_FILE:
+        simulation.prune_sink = EventTraceSink(
+            CONFIG.FINALITY_SPILL_FILE, background=CONFIG.LOG_BACKGROUND
+        )
+    if CONFIG.PROFILE_EVENTS:
+        simulation.enable_profiling(CONFIG.PROFILE_RATE_INTERVAL)
 
     logger.info("Simulation started")
     print("Simulation started")
+    if CONFIG.PARALLEL_WORKERS > 1:
+        run_parallel_simulation(peers_network)
+        sys.exit()
+    sampler = None
+    if CONFIG.SAMPLE_FILE:
+        sampler = StateSampler(
+            CONFIG.SAMPLE_FILE,
+            simulation,
+            peers_network,
+            sim_interval=CONFIG.SAMPLE_SIM_INTERVAL,
+            wall_interval=CONFIG.SAMPLE_WALL_INTERVAL,
+        )
+        simulation.reg_run_hooks(sampler)
+    metrics_stream = None
+    if CONFIG.METRICS_FILE:
+        metrics_stream = MetricsStream(
+            CONFIG.METRICS_FILE,
+            simulation,
+            peers_network,
+            CONFIG.METRICS_SIM_INTERVAL,
+            CONFIG.METRICS_STOP_TOLERANCE,
+            CONFIG.METRICS_STOP_WINDOW,
+        )
+        simulation.reg_run_hooks(metrics_stream)
+    if memory:
+        simulation.reg_run_hooks(memory)
     try:
         (pbar_txns, pbar_blocks) = setup_progressbars()
+        pbar_blocks.update(successful_blocks_mined)
         simulation.reg_run_hooks(
             lambda event: update_progressbars(pbar_txns, pbar_blocks, event)
         )
-        simulation.run()
+        simulation.run(until=CONFIG.MAX_SIM_TIME or math.inf)
+        if CONFIG.PROPAGATION_FILE and not CONFIG.HONEST_POOLS:
+            # network arrivals only, before the merge delivers the rest
+            save_propagation(CONFIG.PROPAGATION_FILE, peers_network)
+        if simulation.stop_sim:
+            reconcile_chains(peers_network)
         logger.info("Simulation ended")
     except KeyboardInterrupt:
         logger.info("Simulation interrupted")
@@ -227,6 +388,23 @@ if __name__ == "__main__":
         pbar_txns.close()
         pbar_blocks.close()
         print("Simulation ended")
+        if simulation.profiler:
+            simulation.profiler.stop()
+            print(simulation.profiler.summary())
+        if simulation.trace_sink:
+            simulation.trace_sink.close()
+        if simulation.prune_sink:
+            simulation.prune_sink.close()
+        if simulation.trace_recorder:
+            simulation.trace_recorder.close()
+        if sampler:
+            sampler.close()
+        if metrics_stream:
+            metrics_stream.close()
+        stop_background_logging()
+        if memory:
+            # the simulation state, before export builds its dicts
+            memory.snapshot("end")
 
         for peer in peers_network:
             peer.block_chain.plot_frame()
@@ -234,3 +412,18 @@ if __name__ == "__main__":
         export_data(peers_network)
         logger.info("Data exported")
         print("Data exported")
+
+        if memory:
+            num_blocks = len(simulation.block_registry)
+            num_txns = simulation.ids.peek("txn")
+            memory.stop()
+            memory.write_report("memory_report.txt", num_blocks, num_txns)
+            problems = memory.check_budget(
+                num_blocks,
+                num_txns,
+                CONFIG.MEMORY_BUDGET_PER_BLOCK,
+                CONFIG.MEMORY_BUDGET_PER_TXN,
+            )
+            if problems:
+                print("memory budget exceeded:", "; ".join(problems))
+                sys.exit(1)
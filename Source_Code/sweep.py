@@ -0,0 +1,310 @@
+"""
+Adaptive (Z1, Z2) sweep of the full simulation with sequential stopping.
+
+Every grid point runs replicates (seeds --seed, --seed + 1, ..., the same
+seeds at every point) until the 95% confidence interval of mpu_adv and
+mpu_overall of both selfish peers is at most --ci-width wide, or --max-runs
+replicates ran. Free workers go to the points whose interval is furthest
+from the target, so quiet points stop after --min-runs and noisy ones
+(Z1 close to Z2) get the runs. With --stop-tolerance every run also ends
+early once its streamed MPU ratios are stable (METRICS_STOP_TOLERANCE).
+
+Each replicate runs simulation.py in its own process and directory
+<out>/z1_<z1>_z2_<z2>/seed_<seed>. The report goes to <out>/sweep.json.
+
+Usage: python sweep.py --z1 0.1 0.2 0.3 --z2 0.1 0.2 --ci-width 0.05 --workers 4
+"""
+
+import os
+import sys
+import ast
+import json
+import math
+import runpy
+import logging
+import argparse
+import multiprocessing
+from time import process_time
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+from config import CONFIG
+
+logger = logging.getLogger(__name__)
+
+SOURCE_DIR = os.path.dirname(os.path.abspath(__file__))
+SELFISH = ("S01", "S02")
+METRICS = ("mpu_adv", "mpu_overall")
+
+# two sided 95% Student t quantiles by degrees of freedom, normal beyond
+T_975 = [
+    math.inf,
+    12.706, 4.303, 3.182, 2.776, 2.571, 2.447, 2.365, 2.306, 2.262, 2.228,
+    2.201, 2.179, 2.160, 2.145, 2.131, 2.120, 2.110, 2.101, 2.093, 2.086,
+    2.080, 2.074, 2.069, 2.064, 2.060, 2.056, 2.052, 2.048, 2.045, 2.042,
+]  # fmt: skip
+
+
+def t_quantile(df: int) -> float:
+    return T_975[df] if df < len(T_975) else 1.96
+
+
+def run_replicate(
+    z1: float,
+    z2: float,
+    seed: int,
+    run_dir: str,
+    overrides: dict,
+    keep_results: bool = False,
+):
+    """
+    one simulation.py run in a fresh process, the selfish rows of its summary
+    """
+    os.makedirs(run_dir, exist_ok=True)
+    os.chdir(run_dir)
+    log = os.open("run.log", os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    os.dup2(log, sys.stdout.fileno())
+    os.dup2(log, sys.stderr.fileno())
+
+    CONFIG.Z1 = z1
+    CONFIG.Z2 = z2
+    CONFIG.SEED = seed
+    CONFIG.SAVE_RESULTS = False  # results land in run_dir
+    CONFIG.VISUALIZE = False
+    for key, value in overrides.items():
+        setattr(CONFIG, key, value)
+    sys.argv = ["simulation.py"]
+    start = process_time()
+    try:
+        runpy.run_path(os.path.join(SOURCE_DIR, "simulation.py"), run_name="__main__")
+    except SystemExit as e:
+        if e.code:
+            raise RuntimeError(f"{run_dir}: simulation exited with {e.code}")
+    cpu_seconds = process_time() - start
+
+    with open("summary.json") as f:
+        ratios = json.load(f)
+    if not keep_results:
+        os.remove("results.json")
+        os.remove("results.pkl")
+    return {
+        "seed": seed,
+        "cpu_seconds": cpu_seconds,
+        "ratios": {
+            ratio["peer_id"]: {metric: ratio[metric] for metric in METRICS}
+            for ratio in ratios
+            if ratio["peer_id"] in SELFISH
+        },
+    }
+
+
+class Point:
+    """
+    replicates of one (Z1, Z2) grid point and their confidence intervals
+    """
+
+    def __init__(self, z1: float, z2: float):
+        self.z1 = z1
+        self.z2 = z2
+        self.runs: list[dict] = []
+        self.launched = 0
+
+    @property
+    def name(self) -> str:
+        return f"z1_{self.z1}_z2_{self.z2}"
+
+    def samples(self, peer_id: str, metric: str) -> list[float]:
+        return [run["ratios"][peer_id][metric] for run in self.runs]
+
+    def interval(self, peer_id: str, metric: str) -> tuple[float, float]:
+        """
+        mean and 95% confidence interval width, inf below two runs
+        """
+        values = self.samples(peer_id, metric)
+        n = len(values)
+        mean = sum(values) / n if n else math.nan
+        if n < 2:
+            return mean, math.inf
+        variance = sum((value - mean) ** 2 for value in values) / (n - 1)
+        return mean, 2 * t_quantile(n - 1) * math.sqrt(variance / n)
+
+    def widest(self) -> float:
+        return max(
+            self.interval(peer_id, metric)[1]
+            for peer_id in SELFISH
+            for metric in METRICS
+        )
+
+    def runs_needed(self, ci_width: float, min_runs: int, max_runs: int) -> int:
+        """
+        total replicates this point is estimated to need, the width shrinks
+        with the square root of the runs
+        """
+        n = len(self.runs)
+        if n < min_runs:
+            return min_runs
+        widest = self.widest()
+        if widest <= ci_width:
+            return n
+        return min(max_runs, max(n + 1, math.ceil(n * (widest / ci_width) ** 2)))
+
+    def report(self, ci_width: float) -> dict:
+        report = {
+            "z1": self.z1,
+            "z2": self.z2,
+            "runs": len(self.runs),
+            "converged": self.widest() <= ci_width,
+            "cpu_seconds": sum(run["cpu_seconds"] for run in self.runs),
+        }
+        for peer_id in SELFISH:
+            for metric in METRICS:
+                mean, width = self.interval(peer_id, metric)
+                report[f"{peer_id}_{metric}"] = mean
+                report[f"{peer_id}_{metric}_ci_width"] = width
+        return report
+
+
+def next_point(
+    points: list[Point], ci_width: float, min_runs: int, max_runs: int
+) -> Point:
+    """
+    the point most short of its estimated runs, None when every point has
+    what it needs running or done
+    """
+    best, best_missing = None, 0
+    for point in points:
+        missing = point.runs_needed(ci_width, min_runs, max_runs) - point.launched
+        if missing > best_missing:
+            best, best_missing = point, missing
+    return best
+
+
+def sweep(
+    z1s: list[float],
+    z2s: list[float],
+    ci_width: float,
+    min_runs: int,
+    max_runs: int,
+    workers: int,
+    seed: int,
+    out: str,
+    overrides: dict,
+    keep_results: bool = False,
+) -> list[dict]:
+    points = [Point(z1, z2) for z1 in z1s for z2 in z2s if z1 + z2 < 1]
+    running = {}
+    # a fresh interpreter per replicate, the simulator keeps global state
+    with ProcessPoolExecutor(
+        workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        max_tasks_per_child=1,
+    ) as pool:
+        while True:
+            while len(running) < workers:
+                point = next_point(points, ci_width, min_runs, max_runs)
+                if point is None:
+                    break
+                run_seed = seed + point.launched
+                point.launched += 1
+                run_dir = os.path.join(out, point.name, f"seed_{run_seed}")
+                future = pool.submit(
+                    run_replicate,
+                    point.z1,
+                    point.z2,
+                    run_seed,
+                    run_dir,
+                    overrides,
+                    keep_results,
+                )
+                running[future] = point
+            if not running:
+                break
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                point = running.pop(future)
+                point.runs.append(future.result())
+                print(
+                    f"{point.name}: {len(point.runs)} runs, "
+                    f"widest ci {point.widest():.4f}",
+                    flush=True,
+                )
+
+    reports = [point.report(ci_width) for point in points]
+    with open(os.path.join(out, "sweep.json"), "w") as f:
+        json.dump(reports, f, indent=4)
+    return reports
+
+
+def parse_override(text: str) -> tuple[str, object]:
+    key, _, value = text.partition("=")
+    try:
+        return key.strip(), ast.literal_eval(value.strip())
+    except (ValueError, SyntaxError):
+        return key.strip(), value.strip()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--z1", type=float, nargs="+", required=True)
+    parser.add_argument("--z2", type=float, nargs="+", required=True)
+    parser.add_argument(
+        "--ci-width", type=float, default=0.05, help="target 95%% CI width"
+    )
+    parser.add_argument("--min-runs", type=int, default=3)
+    parser.add_argument("--max-runs", type=int, default=30)
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--seed", type=int, default=CONFIG.SEED or 0)
+    parser.add_argument("--out", default="sweep")
+    parser.add_argument(
+        "--stop-tolerance",
+        type=float,
+        default=None,
+        help="end runs early once their MPU ratios are stable to this",
+    )
+    parser.add_argument(
+        "--keep-results",
+        action="store_true",
+        help="keep results.json / results.pkl of every run",
+    )
+    parser.add_argument(
+        "--set",
+        action="append",
+        default=[],
+        metavar="KEY=VALUE",
+        help="config.py override for every run, e.g. MAX_NUM_BLOCKS=500",
+    )
+    args = parser.parse_args()
+
+    overrides = dict(parse_override(text) for text in args.set)
+    if args.stop_tolerance is not None:
+        overrides.setdefault("METRICS_FILE", "metrics.jsonl")
+        overrides["METRICS_STOP_TOLERANCE"] = args.stop_tolerance
+    os.makedirs(args.out, exist_ok=True)
+    out = os.path.abspath(args.out)
+    reports = sweep(
+        args.z1,
+        args.z2,
+        args.ci_width,
+        args.min_runs,
+        args.max_runs,
+        args.workers,
+        args.seed,
+        out,
+        overrides,
+        args.keep_results,
+    )
+    for report in reports:
+        print(
+            f"z1={report['z1']} z2={report['z2']} runs={report['runs']} "
+            f"converged={report['converged']} cpu={report['cpu_seconds']:.1f}s "
+            + " ".join(
+                f"{peer_id}_{metric}={report[f'{peer_id}_{metric}']:.4f}"
+                f"±{report[f'{peer_id}_{metric}_ci_width'] / 2:.4f}"
+                for peer_id in SELFISH
+                for metric in METRICS
+            )
+        )
+    print(f"{sum(report['runs'] for report in reports)} runs, results in {out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+import os
+import sys
+import runpy
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+from config import CONFIG
+
+SOURCE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# measured with the run below on CPython 3.11: 1676 bytes per block, 4098 bytes
+# per txn (end snapshot, see memprofile.py), the budgets leave some headroom.
+# Most of the per txn bytes are relay dedup entries, one per peer and link,
+# so the figure grows with NUMBER_OF_PEERS.
+BYTES_PER_BLOCK = 2500
+BYTES_PER_TXN = 5000
+
+
+def test_memory_budget(tmp_path, monkeypatch):
+    """
+    a small seeded run under MemoryAccounting stays within the bytes per
+    block / txn budget
+    """
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(sys, "argv", ["simulation.py"])
+    for key, value in {
+        "NUMBER_OF_PEERS": 12,
+        "Z1": 0.3,
+        "Z2": 0.2,
+        "SEED": 3,
+        "MAX_NUM_BLOCKS": 30,
+        "NUMBER_OF_TRANSACTIONS": 150,
+        "SAVE_RESULTS": False,
+        "VISUALIZE": False,
+        "MEMORY_PROFILE": True,
+        "MEMORY_SNAPSHOT_INTERVAL": 0,
+    }.items():
+        monkeypatch.setattr(CONFIG, key, value)
+
+    run = runpy.run_path(os.path.join(SOURCE_DIR, "simulation.py"), run_name="__main__")
+    memory = run["memory"]
+    num_blocks = len(run["simulation"].block_registry)
+    num_txns = run["simulation"].ids.peek("txn")
+
+    assert num_blocks > CONFIG.MAX_NUM_BLOCKS
+    assert num_txns >= CONFIG.NUMBER_OF_TRANSACTIONS
+    assert memory.snapshots[-1]["label"] == "end"
+    assert memory.check_budget(num_blocks, num_txns, BYTES_PER_BLOCK, BYTES_PER_TXN) == []
+
+
+def _finality_run(run_dir: str, finality_depth: int) -> tuple[int, list[dict]]:
+    """
+    a small seeded run in a fresh process: how many registry rows it dropped
+    and its summary rows
+    """
+    os.makedirs(run_dir)
+    os.chdir(run_dir)
+    sys.argv = ["simulation.py"]
+    for key, value in {
+        "NUMBER_OF_PEERS": 12,
+        "Z1": 0.3,
+        "Z2": 0.2,
+        "SEED": 1,
+        "MAX_NUM_BLOCKS": 60,
+        "NUMBER_OF_TRANSACTIONS": 300,
+        "SAVE_RESULTS": False,
+        "VISUALIZE": False,
+        "FINALITY_DEPTH": finality_depth,
+    }.items():
+        setattr(CONFIG, key, value)
+
+    run = runpy.run_path(os.path.join(SOURCE_DIR, "simulation.py"), run_name="__main__")
+    from metrics import mpu_ratio
+
+    rows = [mpu_ratio(peer) for peer in run["peers_network"]]
+    return run["simulation"].block_registry.base, rows
+
+
+def test_finality_drops_blocks(tmp_path):
+    """
+    with FINALITY_DEPTH the registry drops the blocks every peer finalized,
+    the MPU ratios stay those of the run without finality
+    """
+    spawn = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(2, mp_context=spawn) as pool:
+        final = pool.submit(_finality_run, str(tmp_path / "final"), 10)
+        full = pool.submit(_finality_run, str(tmp_path / "full"), None)
+        dropped, rows = final.result()
+        kept, expected = full.result()
+
+    assert kept == 0
+    assert dropped > 0
+    assert rows == expected
@@ -1,28 +1,31 @@
-import string
 import random
 import os
 
 
-def generate_random_id(length=4):
-    # Define the characters to choose from
-    characters = (
-        string.ascii_uppercase + string.digits
-    )  # You can customize this as needed
-
-    # Generate a random 4-character ID
-    random_id = "".join(random.choice(characters) for _ in range(length))
-
-    return random_id
+def format_id(prefix: str, value: int) -> str:
+    """
+    Readable form of an integer id, only used when exporting
+    """
+    return f"{prefix}{value:04d}"
 
 
-def expon_distribution(mean: float):
+def expon_distribution(mean: float, rng: random.Random = random):
     """
     Generate a random number from exponential distribution with given mean
     """
-    sample = random.expovariate(1 / mean)
+    sample = rng.expovariate(1 / mean)
     return round(sample, 6)
 
 
+def spawn_rng() -> random.Random:
+    """
+    Independent random stream for one simulated entity, seeded from the global RNG.
+    Per entity streams make the draws independent of the order in which
+    events of different peers are executed.
+    """
+    return random.Random(random.getrandbits(64))
+
+
 def create_directory(directory_path):
     """
     Create a directory if it does not exist.